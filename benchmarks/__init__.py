@@ -0,0 +1,5 @@
+"""Benchmarks of VISHack.
+
+Run with :code:`python -m benchmarks.run` from the root of the repository.
+See :code:`python -m benchmarks.run -h` for the options.
+"""
@@ -0,0 +1,216 @@
+"""Synthetic diaggui XML files for benchmarks.
+
+The files are readable by :code:`dtt2hdf.read_diaggui()`. Channel 0 is the
+excitation. The results are the PSD of all channels, and the CSD and
+coherence between channel 0 and the others. Each test, i.e. the PSD of a
+channel and the transfer function and coherence between channel 0 and
+another channel, has its own references.
+"""
+
+import base64
+
+import numpy as np
+
+xml_header = '<?xml version="1.0"?>\n<LIGO_LW Name="Diagnostics Test">\n'
+xml_footer = '</LIGO_LW>\n'
+
+
+def channel_names(n_channels, prefix='K1:VIS-BENCH'):
+    """Return the channel names of a synthetic file.
+
+    Parameters
+    ----------
+    n_channels: int
+        The number of channels.
+    prefix: string, optional
+        The prefix of the channel names.
+        Defaults to 'K1:VIS-BENCH'.
+
+    Returns
+    -------
+    list of strings
+        The channel names.
+    """
+
+    return(['{}_CH{}_OUT'.format(prefix, i) for i in range(n_channels)])
+
+
+def write_diaggui(path, n_channels=4, n_bins=81, n_references=3, df=0.125,
+        anomaly=0., seed=None):
+    """Write a synthetic diaggui XML file.
+
+    Parameters
+    ----------
+    path: string
+        The path of the file.
+    n_channels: int, optional
+        The number of channels, at least 2.
+        Defaults to 4.
+    n_bins: int, optional
+        The number of frequency bins.
+        Defaults to 81.
+    n_references: int, optional
+        The number of references of each test.
+        Defaults to 3.
+    df: float, optional
+        The frequency spacing.
+        Defaults to 0.125.
+    anomaly: float, optional
+        The fractional deviation of the results of every other channel
+        from the references, to trigger alerts.
+        Defaults to 0.
+    seed: int, optional
+        The seed of the random generator.
+        Defaults to None.
+    """
+
+    if n_channels < 2:
+        raise ValueError('n_channels must be at least 2.')
+    rng = np.random.default_rng(seed)
+    channels = channel_names(n_channels)
+    f = df*np.arange(n_bins)
+    noise = 0.05
+
+    def perturb(data, deviation=0.):
+        scale = 1 + deviation + noise*rng.standard_normal(n_bins)
+        return(data*scale)
+
+    asd = [(1+i)/(1+(f/(1+i))**2) + 1e-3 for i in range(n_channels)]
+    tf = [1/(1+1j*f/(0.5*i)) for i in range(1, n_channels)]
+    coh = [np.clip(0.95 - 0.05*rng.random(n_bins), 0, 1)
+        for i in range(1, n_channels)]
+
+    def deviation(i):
+        return(anomaly if i % 2 == 1 else 0.)
+
+    nodes = []
+    # Results
+    result_asd = [perturb(asd[i], deviation(i)) for i in range(n_channels)]
+    for i in range(n_channels):
+        nodes.append(('Result', 'Spectrum', 1, channels[i], [],
+            result_asd[i].astype('f4')))
+    csd = np.array([
+        perturb(tf[j], deviation(j+1))*result_asd[0]**2
+        for j in range(n_channels-1)])
+    nodes.append(('Result', 'Spectrum', 2, channels[0], channels[1:],
+        csd.astype('c8')))
+    result_coh = np.array([
+        np.clip(perturb(coh[j], deviation(j+1)), 0, 1)
+        for j in range(n_channels-1)])
+    nodes.append(('Result', 'Spectrum', 3, channels[0], channels[1:],
+        result_coh.astype('f4')))
+    # References
+    for _ in range(n_references):
+        for i in range(n_channels):
+            nodes.append(('Reference', 'Spectrum', 1, channels[i], [],
+                perturb(asd[i]).astype('f4')))
+        for j in range(n_channels-1):
+            # dtt2hdf conjugates transfer functions when reading.
+            nodes.append(('Reference', 'TransferFunction', 0, channels[0],
+                [channels[j+1]], perturb(tf[j]).conjugate().astype('c8')))
+            nodes.append(('Reference', 'TransferFunction', 2, channels[0],
+                [channels[j+1]],
+                np.clip(perturb(coh[j]), 0, 1).astype('f4')))
+
+    counts = {'Result': 0, 'Reference': 0}
+    with open(path, 'w') as f_xml:
+        f_xml.write(xml_header)
+        for kind, node_type, subtype, channel_a, channel_bs, data in nodes:
+            f_xml.write(_node_string(
+                name='{}[{}]'.format(kind, counts[kind]),
+                node_type=node_type, subtype=subtype, df=df,
+                channel_a=channel_a, channel_bs=channel_bs, data=data,
+                averages=10 if kind == 'Result' else 1))
+            counts[kind] += 1
+        f_xml.write(xml_footer)
+
+
+def _node_string(name, node_type, subtype, df, channel_a, channel_bs, data,
+        averages):
+    """Return the XML of a result or a reference."""
+    data = np.atleast_2d(data)
+    m, n = data.shape
+    if np.iscomplexobj(data):
+        array_type = 'floatComplex'
+    else:
+        array_type = 'float'
+    lines = [
+        '  <LIGO_LW Name="{}" Type="{}">'.format(name, node_type),
+        '    <Param Name="Flag" Type="string">Result</Param>',
+        '    <Param Name="Subtype" Type="int">{}</Param>'.format(subtype),
+        '    <Param Name="f0" Type="double" Unit="Hz">0</Param>',
+        '    <Param Name="df" Type="double" Unit="Hz">{!r}</Param>'.format(
+            df),
+        '    <Time Name="t0" Type="GPS">1285353430.0</Time>',
+        '    <Param Name="BW" Type="double" Unit="Hz">{!r}</Param>'.format(
+            1.5*df),
+        '    <Param Name="Window" Type="int">1</Param>',
+        '    <Param Name="AverageType" Type="int">0</Param>',
+        '    <Param Name="Averages" Type="int">{}</Param>'.format(averages),
+        '    <Param Name="N" Type="int">{}</Param>'.format(n),
+        '    <Param Name="M" Type="int">{}</Param>'.format(m),
+        '    <Param Name="ChannelA" Type="string" Unit="channel">{}</Param>'
+            ''.format(channel_a),
+    ]
+    for i, channel_b in enumerate(channel_bs):
+        lines.append('    <Param Name="ChannelB[{}]" Type="string" '
+            'Unit="channel">{}</Param>'.format(i, channel_b))
+    lines.append('    <Array Type="{}">'.format(array_type))
+    if m > 1:
+        lines.append('      <Dim>{}</Dim>'.format(m))
+    lines.append('      <Dim>{}</Dim>'.format(n))
+    stream = base64.encodebytes(
+        np.ascontiguousarray(data).astype(data.dtype.newbyteorder('<'))
+        .tobytes()).decode()
+    lines.append('      <Stream Encoding="LittleEndian,base64">\n'
+        '{}      </Stream>'.format(stream))
+    lines.append('    </Array>')
+    lines.append('  </LIGO_LW>')
+    return('\n'.join(lines)+'\n')
+
+
+def write_config(path, directory, report_path=None, methods=None):
+    """Write a health check config for a directory of synthetic files.
+
+    Parameters
+    ----------
+    path: string
+        The path of the config file.
+    directory: string
+        The directory of the diaggui XML files.
+    report_path: string, optional
+        The path of the report. If None, no report is written.
+        Defaults to None.
+    methods: list of strings, optional
+        The methods of all types of tests. Defaults to all methods.
+    """
+
+    if methods is None:
+        methods = ['MSE', 'WMSE', 'MAE', 'WMAE', 'RMS', 'WRMS']
+    lines = ['[General]']
+    if report_path is None:
+        lines.append('Output report = false')
+    else:
+        lines.append('Output report = true')
+        lines.append('Report path = {}'.format(report_path))
+        lines.append('Overwrite report = true')
+    lines += [
+        'Alert threshold = 3',
+        '',
+        '[Directory settings]',
+        'Include subfolders = false',
+        '',
+        '[Directories]',
+        directory,
+        '',
+    ]
+    for type in ['Transfer function', 'Power spectral density',
+            'Coherence']:
+        lines += [
+            '[{}]'.format(type),
+            'check = true',
+            'methods = {}'.format(', '.join(methods)),
+            '',
+        ]
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
@@ -0,0 +1,161 @@
+"""Import time of VISHack and its command line tools.
+
+Each import is timed in a new interpreter, which also reports the heavy
+dependencies the import pulled in. The command line tools shouldn't pull in
+any of them until they are needed, which can be checked with
+
+    python -m benchmarks.import_time --check
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+heavy_modules = ('numpy', 'pandas', 'dtt2hdf', 'declarative', 'ezca')
+# The statements to be timed and whether they may import heavy modules.
+targets = {
+    'vishack': ('import vishack', False),
+    'vishack.clitools.print_vishack': (
+        'import vishack.clitools.print_vishack', False),
+    'vishack.clitools.generate_sample_config': (
+        'import vishack.clitools.generate_sample_config', False),
+    'vishack.clitools.healthcheck': (
+        'import vishack.clitools.healthcheck', False),
+    'vishack.clitools.read_time_average': (
+        'import vishack.clitools.read_time_average', False),
+    # The sample config is written to a temporary directory.
+    'vishack.clitools.read_time_average -g': (
+        'import os, tempfile\n'
+        'cwd = os.getcwd()\n'
+        'with tempfile.TemporaryDirectory() as directory:\n'
+        '    os.chdir(directory)\n'
+        '    import vishack.clitools.read_time_average\n'
+        '    vishack.clitools.read_time_average.main([\'-g\'])\n'
+        '    os.chdir(cwd)', False),
+    'vishack.core.config': ('import vishack.core.config', False),
+    'vishack.HealthCheck': ('import vishack; vishack.HealthCheck', True),
+}
+script = """import time
+start = time.perf_counter()
+{}
+elapsed = time.perf_counter() - start
+import json, sys
+print(json.dumps({{
+    'time': elapsed,
+    'modules': [m for m in {!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(statement):
+    """Time a statement in a new interpreter.
+
+    Parameters
+    ----------
+    statement: string
+        The statement, e.g. 'import vishack'.
+
+    Returns
+    -------
+    float
+        The time (s) of the statement.
+    list of strings
+        The heavy modules imported by the statement.
+    """
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + ([env['PYTHONPATH']] if 'PYTHONPATH' in env else []))
+    output = subprocess.run(
+        [sys.executable, '-c', script.format(statement, heavy_modules)],
+        stdout=subprocess.PIPE, check=True, cwd=root, env=env,
+        universal_newlines=True).stdout
+    result = json.loads(output.splitlines()[-1])
+    return(result['time'], result['modules'])
+
+
+def benchmark_imports(repeat=5):
+    """Time the imports of the targets.
+
+    Parameters
+    ----------
+    repeat: int, optional
+        The number of measurements of each target.
+        Defaults to 5.
+
+    Returns
+    -------
+    dict
+        The timings with "import <target>" as the keys, in the format of
+        :code:`benchmarks.run.timeit()`, with the heavy modules imported
+        under "modules".
+    """
+
+    results = {}
+    for name, (statement, _) in targets.items():
+        times = []
+        for _ in range(repeat):
+            elapsed, modules = measure_import(statement)
+            times.append(elapsed)
+        results['import '+name] = {
+            'min': min(times),
+            'median': statistics.median(times),
+            'mean': statistics.mean(times),
+            'repeat': repeat,
+            'number': 1,
+            'modules': modules,
+        }
+    return(results)
+
+
+def check_imports():
+    """Return the targets that import heavy modules they shouldn't.
+
+    Returns
+    -------
+    dict
+        The heavy modules imported by each offending target.
+    """
+
+    offenders = {}
+    for name, (statement, heavy) in targets.items():
+        if heavy:
+            continue
+        _, modules = measure_import(statement)
+        if len(modules) > 0:
+            offenders[name] = modules
+    return(offenders)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.import_time',
+        description='Time the imports of VISHack and its command line '
+            'tools.')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help='The number of measurements of each import. Defaults to 5.')
+    parser.add_argument(
+        '--check', action='store_true',
+        help='Fail if a command line tool imports a heavy dependency, '
+            'i.e. one of {}.'.format(', '.join(heavy_modules)))
+    args = parser.parse_args(argv)
+
+    if args.check:
+        offenders = check_imports()
+        for name, modules in offenders.items():
+            print('{} imports {}'.format(name, ', '.join(modules)))
+        return(1 if offenders else 0)
+
+    for name, timing in benchmark_imports(repeat=args.repeat).items():
+        print('{:<48} min {:>8.1f} ms  median {:>8.1f} ms  {}'.format(
+            name, 1e3*timing['min'], 1e3*timing['median'],
+            ', '.join(timing['modules'])))
+    return(0)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
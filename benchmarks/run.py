@@ -0,0 +1,339 @@
+"""Time the hot paths of VISHack on synthetic diaggui XML files.
+
+The results are written as JSON so that they can be compared between
+releases, e.g.
+
+    python -m benchmarks.run --output before.json
+    python -m benchmarks.run --output after.json --compare before.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import vishack
+import vishack.core.evaluate
+from vishack.logger import logger
+
+from benchmarks import diaggui_xml, import_time
+
+scales = {
+    'small': {
+        'n_files': 2, 'n_channels': 4, 'n_bins': 201, 'n_references': 3},
+    'medium': {
+        'n_files': 8, 'n_channels': 8, 'n_bins': 1601, 'n_references': 5},
+    'large': {
+        'n_files': 16, 'n_channels': 16, 'n_bins': 6401, 'n_references': 10},
+}
+evaluate_functions = ['mse', 'wmse', 'mae', 'wmae', 'rms', 'wrms']
+methods = ['MSE', 'WMSE', 'MAE', 'WMAE', 'RMS', 'WRMS']
+
+
+def timeit(func, repeat=5, number=1, setup=None, warmup=1):
+    """Time a function.
+
+    Parameters
+    ----------
+    func: function
+        The function to be timed. Called with the return of setup, if any.
+    repeat: int, optional
+        The number of measurements.
+        Defaults to 5.
+    number: int, optional
+        The number of calls in each measurement.
+        Defaults to 1.
+    setup: function, optional
+        Called before each measurement, untimed.
+        Defaults to None.
+    warmup: int, optional
+        The number of untimed calls before the measurements, so that
+        imports and caches filled by the first call are not timed.
+        Defaults to 1.
+
+    Returns
+    -------
+    dict
+        The minimum, median and mean time (s) of a call, with the keys
+        "min", "median" and "mean", and the repeat and number.
+    """
+
+    for _ in range(warmup):
+        func(*(() if setup is None else (setup(),)))
+    times = []
+    for _ in range(repeat):
+        args = () if setup is None else (setup(),)
+        start = time.perf_counter()
+        for _ in range(number):
+            func(*args)
+        times.append((time.perf_counter()-start)/number)
+    return({
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'repeat': repeat,
+        'number': number,
+    })
+
+
+def benchmark_healthcheck(directory, n_files, n_channels, n_bins,
+        n_references, repeat=5, seed=0):
+    """Time HealthCheck on synthetic diaggui XML files.
+
+    Parameters
+    ----------
+    directory: string
+        The directory where the files are written.
+    n_files: int
+        The number of diaggui XML files.
+    n_channels: int
+        The number of channels in each file.
+    n_bins: int
+        The number of frequency bins.
+    n_references: int
+        The number of references of each test.
+    repeat: int, optional
+        The number of measurements.
+        Defaults to 5.
+    seed: int, optional
+        The seed of the synthetic data.
+        Defaults to 0.
+
+    Returns
+    -------
+    dict
+        The timings with "HealthCheck.__init__", "HealthCheck.check",
+        "HealthCheck.get_alerts" and "HealthCheck.print_report" as the keys.
+    """
+
+    data_directory = os.path.join(directory, 'diaggui')
+    os.makedirs(data_directory, exist_ok=True)
+    for i in range(n_files):
+        diaggui_xml.write_diaggui(
+            os.path.join(data_directory, 'bench_{}.xml'.format(i)),
+            n_channels=n_channels, n_bins=n_bins, n_references=n_references,
+            anomaly=0.5, seed=seed+i)
+    config = os.path.join(directory, 'bench.ini')
+    diaggui_xml.write_config(config, data_directory)
+    report_path = os.path.join(directory, 'bench_report.rst')
+
+    def checked():
+        hc = vishack.HealthCheck(config)
+        hc.check()
+        return(hc)
+
+    results = {}
+    results['HealthCheck.__init__'] = timeit(
+        lambda: vishack.HealthCheck(config), repeat=repeat)
+    results['HealthCheck.check'] = timeit(
+        lambda hc: hc.check(), repeat=repeat,
+        setup=lambda: vishack.HealthCheck(config))
+    results['HealthCheck.get_alerts'] = timeit(
+        lambda hc: hc.get_alerts(), repeat=repeat, setup=checked)
+    results['HealthCheck.print_report'] = timeit(
+        lambda hc: hc.print_report(report_path, overwrite=True),
+        repeat=repeat, setup=checked)
+    return(results)
+
+
+def benchmark_evaluate(n_bins, n_references, repeat=5, number=100, seed=0):
+    """Time the functions of vishack.core.evaluate on random spectra.
+
+    Parameters
+    ----------
+    n_bins: int
+        The number of frequency bins.
+    n_references: int
+        The number of references.
+    repeat: int, optional
+        The number of measurements.
+        Defaults to 5.
+    number: int, optional
+        The number of calls in each measurement.
+        Defaults to 100.
+    seed: int, optional
+        The seed of the random spectra.
+        Defaults to 0.
+
+    Returns
+    -------
+    dict
+        The timings with "evaluate.<function>" as the keys.
+    """
+
+    rng = np.random.default_rng(seed)
+    shape = (n_references, n_bins)
+    references = (1+0.1*rng.standard_normal(shape)
+        + 0.1j*rng.standard_normal(shape)).astype('c8')
+    data = references[0]*(1+0.05*rng.standard_normal(n_bins))
+    evaluate = vishack.core.evaluate
+
+    results = {}
+    for name in evaluate_functions:
+        func = getattr(evaluate, name)
+        if name in ['rms', 'wrms']:
+            call = lambda func=func: func(data, df=0.125)
+        else:
+            call = lambda func=func: func(data, references[1])
+        results['evaluate.'+name] = timeit(call, repeat=repeat, number=number)
+    if hasattr(evaluate, 'evaluate_batch'):
+        results['evaluate.evaluate_batch'] = timeit(
+            lambda: evaluate.evaluate_batch(
+                data, references, methods, df=0.125),
+            repeat=repeat, number=number)
+    if hasattr(evaluate, 'Workspace'):
+        workspace = evaluate.Workspace()
+        results['evaluate.evaluate_batch (single)'] = timeit(
+            lambda: evaluate.evaluate_batch(
+                data, references, methods, df=0.125, precision='single',
+                workspace=workspace),
+            repeat=repeat, number=number)
+    if hasattr(evaluate, 'pairwise_evaluate'):
+        results['evaluate.pairwise_evaluate'] = timeit(
+            lambda: evaluate.pairwise_evaluate(
+                references, methods, df=0.125),
+            repeat=repeat, number=number)
+    return(results)
+
+
+def metadata():
+    """Return the environment of the benchmarks."""
+    return({
+        'vishack': vishack.__version__,
+        'numpy': np.__version__,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'timestamp': datetime.datetime.now(
+            datetime.timezone.utc).isoformat(),
+    })
+
+
+def run(scale_names, repeat=5, seed=0):
+    """Run the benchmarks.
+
+    Parameters
+    ----------
+    scale_names: list of strings
+        The scales, from 'small', 'medium' and 'large'.
+    repeat: int, optional
+        The number of measurements of each benchmark.
+        Defaults to 5.
+    seed: int, optional
+        The seed of the synthetic data.
+        Defaults to 0.
+
+    Returns
+    -------
+    dict
+        The metadata and the timings of each scale and of the imports,
+        with keys "metadata" and "results".
+    """
+
+    results = {}
+    results['imports'] = {
+        'parameters': {},
+        'timings': import_time.benchmark_imports(repeat=repeat),
+    }
+    for name in scale_names:
+        scale = scales[name]
+        with tempfile.TemporaryDirectory(prefix='vishack_bench_') as tmp:
+            results[name] = {
+                'parameters': scale,
+                'timings': benchmark_healthcheck(
+                    tmp, repeat=repeat, seed=seed, **scale),
+            }
+        results[name]['timings'].update(benchmark_evaluate(
+            n_bins=scale['n_bins'], n_references=scale['n_references'],
+            repeat=repeat, seed=seed))
+    return({'metadata': metadata(), 'results': results})
+
+
+def format_results(results, baseline=None):
+    """Format the results as a table, optionally compared to a baseline.
+
+    Parameters
+    ----------
+    results: dict
+        The return of :code:`run()`.
+    baseline: dict, optional
+        Results of an earlier run. The ratios of the median times to the
+        baseline are shown.
+        Defaults to None.
+
+    Returns
+    -------
+    string
+        The table.
+    """
+
+    lines = []
+    for scale, result in results['results'].items():
+        if result['parameters']:
+            lines.append('{} {}'.format(scale, result['parameters']))
+        else:
+            lines.append(scale)
+        for name, timing in result['timings'].items():
+            line = '  {:<48} min {:>10.3f} ms  median {:>10.3f} ms'.format(
+                name, 1e3*timing['min'], 1e3*timing['median'])
+            if baseline is not None:
+                try:
+                    base = baseline['results'][scale]['timings'][name]
+                    line += '  x{:.2f}'.format(
+                        timing['median']/base['median'])
+                except KeyError:
+                    line += '  (new)'
+            lines.append(line)
+    return('\n'.join(lines))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m benchmarks.run',
+        description='Time the hot paths of VISHack on synthetic diaggui '
+            'XML files.')
+    parser.add_argument(
+        '-s', '--scales', nargs='+', choices=list(scales),
+        default=['small', 'medium'],
+        help='The scales to run. Defaults to small and medium.')
+    parser.add_argument(
+        '-r', '--repeat', type=int, default=5,
+        help='The number of measurements of each benchmark. Defaults to 5.')
+    parser.add_argument(
+        '--seed', type=int, default=0,
+        help='The seed of the synthetic data. Defaults to 0.')
+    parser.add_argument(
+        '-o', '--output', help='Write the results to this JSON file.')
+    parser.add_argument(
+        '-c', '--compare',
+        help='A JSON file of earlier results to compare the median times to.')
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    level = logger.level
+    logger.setLevel(logging.WARNING)
+    try:
+        results = run(args.scales, repeat=args.repeat, seed=args.seed)
+    finally:
+        logger.setLevel(level)
+
+    print(format_results(results, baseline=baseline))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
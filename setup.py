@@ -33,11 +33,12 @@ setup(
     author='TSANG Terrence Tak Lun',  # Optional
     author_email='ttltsang@link.cuhk.edu.hk, terrencetec@gmail.com',  # Optional
     keywords='KAGRA, gravitational waves, observatory',  # Optional
-    packages=find_packages(),
-    python_requires='>=3.5, <4',
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
+    python_requires='>=3.8, <4',
     install_requires=[
         'numpy',
         'dtt2hdf',
+        'declarative',
     ], # Dependencies here, Optional
     # List additional groups of dependencies here (e.g. development
     # dependencies). Users will be able to install these using the "extras"
@@ -62,6 +63,7 @@ setup(
             'vishack=vishack.clitools.healthcheck:main',
             'vishack-read-time-average'\
             '=vishack.clitools.read_time_average:main',
+            'vishack-fakediag=vishack.fakediag:main',
         ],
     }
     # List additional URLs that are relevant to your project as a dict.
@@ -0,0 +1,34 @@
+"""The public names of vishack resolve when imported lazily."""
+
+import importlib
+
+import pytest
+
+import vishack
+import vishack.core
+
+
+@pytest.mark.parametrize('name, module', [
+    ('HealthCheck', 'vishack.core.healthcheck'),
+    ('default_header', 'vishack.core.healthcheck'),
+    ('rst_content_string', 'vishack.core.healthcheck'),
+    ('generate_sample_config', 'vishack.core.config'),
+])
+def test_attributes(name, module):
+    value = getattr(importlib.import_module(module), name)
+    assert getattr(vishack, name) is value
+    assert getattr(vishack.core, name) is value
+    assert name in dir(vishack)
+
+
+@pytest.mark.parametrize('name', ['config', 'evaluate', 'healthcheck'])
+def test_core_submodules(name):
+    module = importlib.import_module('vishack.core.'+name)
+    assert getattr(vishack, name) is module
+    assert getattr(vishack.core, name) is module
+    assert name in dir(vishack)
+
+
+def test_unknown_attribute():
+    with pytest.raises(AttributeError):
+        vishack.not_an_attribute
@@ -1,2 +1,35 @@
+import importlib
+
 from ._version import __version__
-from .core import *
+
+# The public API is imported when first used (PEP 562) so that importing
+# vishack, e.g. from the command line tools, doesn't import NumPy and
+# dtt2hdf unless they are needed.
+_lazy_attributes = {
+    'HealthCheck': 'vishack.core.healthcheck',
+    'default_header': 'vishack.core.healthcheck',
+    'rst_content_string': 'vishack.core.healthcheck',
+    'generate_sample_config': 'vishack.core.config',
+}
+_submodules = ('clitools', 'core', 'data', 'fakediag', 'fakeezca')
+# Modules of vishack.core that are also available from vishack.
+_core_submodules = ('config', 'evaluate', 'healthcheck')
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        value = getattr(importlib.import_module(_lazy_attributes[name]), name)
+    elif name in _submodules:
+        value = importlib.import_module('.'+name, __name__)
+    elif name in _core_submodules:
+        value = importlib.import_module('.core.'+name, __name__)
+    else:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name))
+    globals()[name] = value
+    return(value)
+
+
+def __dir__():
+    return(sorted(set(globals()) | set(_lazy_attributes) | set(_submodules)
+        | set(_core_submodules)))
@@ -10,14 +10,43 @@ def parser():
         required=True)
     parser.add_argument('-m', '--measure',
         help='Trigger new measurements', action='store_true')
+    parser.add_argument('-j', '--jobs', type=int,
+        help='Number of processes used to check the diaggui files '\
+            'in parallel', required=False, default=1)
+    parser.add_argument('--no-cache',
+        help='Bypass the caches specified in the config file',
+        action='store_true')
+    parser.add_argument('--clear-cache',
+        help='Clear the caches specified in the config file '\
+            'before the health check', action='store_true')
+    parser.add_argument('--profile', type=str, metavar='PATH',
+        help='Write the time, count and peak memory of the stages of '\
+            'the health check to this JSON file', required=False)
+    parser.add_argument('--trace-memory',
+        help='Record the peak memory of each stage with tracemalloc. '\
+            'Slows down the health check', action='store_true')
+    parser.add_argument('--cprofile', type=str, metavar='PATH',
+        help='Profile the health check with cProfile and write the '\
+            'profile to this file, readable with pstats',
+        required=False)
     return parser
 
 def main(args=None):
 
+    import contextlib
     import vishack.core.healthcheck
+    import vishack.core.timing
 
     opts = parser().parse_args(args)
     config = opts.config
     measure = opts.measure
-    hc = vishack.core.healthcheck.HealthCheck(config=config)
-    hc.check(new_measurement=measure)
+    timer = vishack.core.timing.StageTimer(trace_memory=opts.trace_memory)
+    with contextlib.ExitStack() as stack:
+        if opts.cprofile is not None:
+            stack.enter_context(vishack.core.timing.profile(opts.cprofile))
+        hc = vishack.core.healthcheck.HealthCheck(
+            config=config, use_cache=not opts.no_cache,
+            clear_cache=opts.clear_cache, timer=timer)
+        hc.check(new_measurement=measure, jobs=opts.jobs)
+    if opts.profile is not None:
+        vishack.core.timing.write_json(hc.timings, opts.profile)
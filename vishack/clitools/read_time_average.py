@@ -3,11 +3,9 @@ import argparse
 import configparser
 import os
 
-from ezca.ezca import Ezca
-import pandas
-
 from vishack.logger import logger
-import vishack.data.ezca
+
+available_statistics = ("mean", "std", "min", "max", "count")
 
 
 def parser():
@@ -23,11 +21,18 @@ def parser():
     parser.add_argument(
         '-f', '--fake-ezca',
         help='Use fake ezca instead.', action='store_true')
+    parser.add_argument(
+        '-m', '--monitor',
+        help='Monitor the channels continuously and write rolling '
+             'averages to the output file periodically. Stop with Ctrl-C.',
+        action='store_true')
 
     return parser
 
 
 def main(args=None):
+    # pandas and ezca are imported only when they are needed, so -g works
+    # without them and -f works without ezca.
     opts = parser().parse_args(args)
     get_config = opts.get_config
     if get_config:
@@ -38,6 +43,8 @@ def main(args=None):
                      "You can use the -g argument to get a sample.")
         return
 
+    import vishack.data.ezca
+
     # Parse config.
     config = configparser.ConfigParser(allow_no_value=True)
     config.optionxform = str
@@ -46,6 +53,16 @@ def main(args=None):
     ezca_prefix = config["config"]["ezca prefix"]
     duration = config["config"].getfloat("duration (s)")
     fs = config["config"].getfloat("sampling frequency (Hz)")
+    max_workers = config["config"].getint(
+        "max workers", fallback=vishack.data.ezca.default_max_workers)
+    statistics = config["config"].get(
+        "statistics", fallback="mean").replace(" ", "").split(",")
+    for statistic in statistics:
+        if statistic not in available_statistics:
+            logger.error("Unknown statistic {}. Available statistics are "
+                         "{}.".format(statistic,
+                                      ", ".join(available_statistics)))
+            return
 
     fake_ezca = opts.fake_ezca
     if fake_ezca:
@@ -55,12 +72,53 @@ def main(args=None):
     ezca = Ezca(ezca_prefix)
     channels = list(config["channels"].keys())
 
-    d_time_average = vishack.data.ezca.parallel_time_average(
-        ezca=ezca, channels=channels, duration=duration, fs=fs)
-    series = pandas.Series(d_time_average)
-    series.to_csv(output_path, header=False)
+    if opts.monitor:
+        monitor(config, ezca, channels, output_path, duration, fs,
+                max_workers)
+        return
+
+    import pandas
+
+    running_statistics = vishack.data.ezca.parallel_time_statistics(
+        ezca=ezca, channels=channels, duration=duration, fs=fs,
+        max_workers=max_workers)
+    d_statistics = running_statistics.to_dict()
+    if statistics == ["mean"]:
+        series = pandas.Series(
+            {channel: d_statistics[channel]["mean"] for channel in channels})
+        series.to_csv(output_path, header=False)
+    else:
+        df = pandas.DataFrame(
+            {statistic: [d_statistics[channel][statistic]
+                         for channel in channels]
+             for statistic in statistics},
+            index=channels)
+        df.to_csv(output_path, index_label="channel")
     
 
+def monitor(config, ezca, channels, output_path, duration, fs, max_workers):
+    """Monitor the channels until interrupted."""
+    import vishack.data.monitor
+
+    windows = config["config"].get("windows (s)", fallback=str(duration))
+    windows = [float(window) for window in windows.split(",")]
+    flush_interval = config["config"].getfloat(
+        "flush interval (s)",
+        fallback=vishack.data.monitor.default_flush_interval)
+    buffer_size = config["config"].getint("buffer size", fallback=None)
+    channel_monitor = vishack.data.monitor.Monitor(
+        ezca=ezca, channels=channels, windows=windows, fs=fs,
+        output_path=output_path, flush_interval=flush_interval,
+        buffer_size=buffer_size, max_workers=max_workers)
+    logger.info("Monitoring {} channels. Writing rolling averages to {} "
+                "every {} s.".format(len(channels), output_path,
+                                     flush_interval))
+    try:
+        channel_monitor.run()
+    except KeyboardInterrupt:
+        logger.info("Monitoring stopped.")
+
+
 def sample_config():
     """Get a sample configuration file."""
     import vishack.data.output
@@ -72,6 +130,10 @@ def sample_config():
         "ezca prefix": "VIS-BS",
         "duration (s)": 1,
         "sampling frequency (Hz)": 1,
+        # vishack.data.ezca.default_max_workers, not imported for -g as it
+        # imports NumPy.
+        "max workers": 16,
+        "statistics": "mean",
     }
     config["channels"] = {
         "IP_IDAMP_L_INMON": None,
@@ -1,2 +1,28 @@
-from .healthcheck import *
-from .config import *
+import importlib
+
+# Imported when first used, see vishack/__init__.py.
+_lazy_attributes = {
+    'HealthCheck': 'vishack.core.healthcheck',
+    'default_header': 'vishack.core.healthcheck',
+    'rst_content_string': 'vishack.core.healthcheck',
+    'generate_sample_config': 'vishack.core.config',
+}
+_submodules = (
+    'band', 'baseline', 'config', 'evaluate', 'healthcheck', 'state',
+    'table', 'timing')
+
+
+def __getattr__(name):
+    if name in _lazy_attributes:
+        value = getattr(importlib.import_module(_lazy_attributes[name]), name)
+    elif name in _submodules:
+        value = importlib.import_module('.'+name, __name__)
+    else:
+        raise AttributeError(
+            'module {!r} has no attribute {!r}'.format(__name__, name))
+    globals()[name] = value
+    return(value)
+
+
+def __dir__():
+    return(sorted(set(globals()) | set(_lazy_attributes) | set(_submodules)))
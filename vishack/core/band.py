@@ -0,0 +1,119 @@
+"""Frequency bands of the health check evaluations.
+"""
+
+import numpy as np
+
+
+class FrequencyBand:
+    """A named frequency band, optionally restricted to some channels.
+
+    Parameters
+    ----------
+    name: string
+        The name of the band.
+    lower: float, optional
+        The lower edge of the band (Hz), included.
+        Defaults to 0.
+    upper: float, optional
+        The upper edge of the band (Hz), included.
+        Defaults to infinity.
+    channels: list of strings, optional
+        The channels the band applies to. If None, the band applies to all
+        channels.
+        Defaults to None.
+
+    Attributes
+    ----------
+    name: string
+        The name of the band.
+    lower: float
+        The lower edge of the band (Hz).
+    upper: float
+        The upper edge of the band (Hz).
+    channels: set of strings
+        The channels the band applies to, or None for all channels.
+    """
+
+    def __init__(self, name, lower=0., upper=np.inf, channels=None):
+        """Initiate FrequencyBand.
+
+        Parameters
+        ----------
+        name: string
+            The name of the band.
+        lower: float, optional
+            The lower edge of the band (Hz), included.
+            Defaults to 0.
+        upper: float, optional
+            The upper edge of the band (Hz), included.
+            Defaults to infinity.
+        channels: list of strings, optional
+            The channels the band applies to. If None, the band applies to
+            all channels.
+            Defaults to None.
+        """
+
+        if lower > upper:
+            raise ValueError('The lower edge of band {} is above the upper '\
+                'edge.'.format(name))
+        self.name = name
+        self.lower = lower
+        self.upper = upper
+        self.channels = None if channels is None else set(channels)
+
+    def __repr__(self):
+        return('FrequencyBand({!r}, lower={!r}, upper={!r}, channels={!r})'\
+            ''.format(self.name, self.lower, self.upper,
+                None if self.channels is None else sorted(self.channels)))
+
+    def applies_to(self, channel_a, channel_b=None):
+        """Whether the band applies to a test.
+
+        Parameters
+        ----------
+        channel_a: string
+            Channel A of the test.
+        channel_b: string, optional
+            Channel B of the test, if any.
+            Defaults to None.
+
+        Returns
+        -------
+        boolean
+            True if the band applies to all channels, or to channel A or
+            channel B.
+        """
+
+        if self.channels is None:
+            return(True)
+        return(channel_a in self.channels or channel_b in self.channels)
+
+    def bins(self, f):
+        """Return the slice of a frequency series evaluated in the band.
+
+        Parameters
+        ----------
+        f: array
+            The frequency axis (Hz), in ascending order.
+
+        Returns
+        -------
+        slice
+            The slice of the frequency series, or None if there are no bins
+            in the band.
+
+        Note
+        ----
+        The functions in :code:`vishack.core.evaluate` skip the first bin,
+        which is the DC bin of a full spectrum. So the slice starts one bin
+        before the first frequency in the band, and the DC bin is never
+        evaluated.
+        """
+
+        f = np.asarray(f)
+        start = int(np.searchsorted(f, self.lower, side='left'))
+        stop = int(np.searchsorted(f, self.upper, side='right'))
+        if stop <= max(start, 1):
+            return(None)
+        return(slice(max(start-1, 0), stop))
+
@@ -0,0 +1,244 @@
+"""Cache of reference baselines, i.e. the statistics between references.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+import vishack.core.evaluate
+import vishack.core.state
+
+
+class BaselineCache:
+    """Cache of the cross evaluations between references.
+
+    The mean and standard deviation of the evaluations between all pairs of
+    references only depend on the references, the method and the frequency
+    spacing. They are keyed by a hash of these so they don't have to be
+    evaluated again when the references haven't changed.
+
+    The baselines are grouped by diaggui XML file. When the cache is saved,
+    the baselines of each file checked are replaced by the ones used in the
+    check, so baselines of references that are no longer in the file are
+    dropped, as are the baselines of files that no longer exist.
+
+    Parameters
+    ----------
+    path: string, optional
+        The path of the JSON file where the baselines are persisted.
+        If None, the baselines are only kept in memory.
+        Defaults to None.
+
+    Attributes
+    ----------
+    path: string
+        The path of the JSON file where the baselines are persisted.
+    baselines: dict
+        The baselines of each diaggui XML file, with the file paths as the
+        keys and dicts with hash keys and [mean, standard deviation] values
+        as the values.
+    used: dict
+        The baselines used for each diaggui XML file since the cache was
+        loaded, in the format of baselines.
+    """
+
+    def __init__(self, path=None):
+        """Initiate BaselineCache, loading the baselines if any.
+
+        Parameters
+        ----------
+        path: string, optional
+            The path of the JSON file where the baselines are persisted.
+            If None, the baselines are only kept in memory.
+            Defaults to None.
+        """
+
+        self.path = path
+        self.baselines = {}
+        if path is not None:
+            self.baselines = vishack.core.state.load_state(path)
+            if not all(isinstance(baselines, dict)
+                    for baselines in self.baselines.values()):
+                # Written by an older version, without the files.
+                self.baselines = {}
+        self.used = {}
+        self._changed = False
+
+    def for_file(self, file):
+        """Return an in-memory cache with the baselines of one file only.
+
+        Parameters
+        ----------
+        file: string
+            The path of the diaggui XML file.
+
+        Returns
+        -------
+        BaselineCache
+            The cache, e.g. to be sent to the worker process checking the
+            file. Its :code:`used` baselines are added back with
+            :code:`update()`.
+        """
+
+        cache = BaselineCache()
+        if file in self.baselines.keys():
+            cache.baselines[file] = dict(self.baselines[file])
+        return(cache)
+
+    def key(self, references, method, df):
+        """Return the key of the baseline.
+
+        Parameters
+        ----------
+        references: list of arrays or string
+            The reference data, or their hash from
+            :code:`hash_references()`.
+        method: string
+            The type of quantity evaluated.
+        df: float
+            The frequency spacing between data points.
+
+        Returns
+        -------
+        string
+            The hex digest of the references, method and df.
+        """
+
+        if not isinstance(references, str):
+            references = hash_references(references)
+        identity = '{}\n{}\n{!r}'.format(references, method, float(df))
+        return(hashlib.sha1(identity.encode()).hexdigest())
+
+    def start(self, file):
+        """Start recording the baselines used for a file.
+
+        The baselines of the file are replaced by the ones used from now on
+        when the cache is saved, even if none are used.
+
+        Parameters
+        ----------
+        file: string
+            The path of the diaggui XML file.
+        """
+
+        self.used[file] = {}
+
+    def evaluate(self, references, methods, df=1., file=None):
+        """Get the mean and standard deviation of the reference evaluations.
+
+        Cached baselines are returned directly. Others are evaluated with
+        :code:`vishack.core.evaluate.pairwise_evaluate()` and cached.
+
+        Parameters
+        ----------
+        references: list of arrays
+            The reference data.
+        methods: list of strings
+            The quantities to be evaluated.
+            Options are 'RMS', 'WRMS', 'MSE', 'WMSE', 'MAE', 'WMAE'.
+        df: float, optional
+            The frequency spacing between data points. Default to be 1.
+        file: string, optional
+            The path of the diaggui XML file of the references.
+            Defaults to None.
+
+        Returns
+        -------
+        dict
+            The mean and the standard deviation of the evaluations over all
+            pairs, with the methods as the keys.
+        """
+
+        file = '' if file is None else file
+        cached = self.baselines.get(file, {})
+        used = self.used.setdefault(file, {})
+        stats = {}
+        keys = {}
+        references_hash = hash_references(references)
+        for method in methods:
+            keys[method] = self.key(references_hash, method, df)
+            if keys[method] in cached.keys():
+                mean, std = cached[keys[method]]
+                stats[method] = (np.float64(mean), np.float64(std))
+                used[keys[method]] = cached[keys[method]]
+        missing = [method for method in methods if method not in stats]
+        if len(missing) > 0:
+            new_stats = vishack.core.evaluate.pairwise_evaluate(
+                references, methods=missing, df=df)
+            cached = self.baselines.setdefault(file, {})
+            for method in new_stats.keys():
+                stats[method] = new_stats[method]
+                cached[keys[method]] = list(new_stats[method])
+                used[keys[method]] = list(new_stats[method])
+            self._changed = True
+        return(stats)
+
+    def update(self, used):
+        """Add the baselines used in another cache, e.g. in another process.
+
+        Parameters
+        ----------
+        used: dict
+            The :code:`used` baselines of the other cache.
+        """
+
+        for file, baselines in used.items():
+            if (file not in self.baselines.keys()
+                    or self.baselines[file].keys() != baselines.keys()):
+                self._changed = True
+            self.baselines.setdefault(file, {}).update(baselines)
+            self.used.setdefault(file, {}).update(baselines)
+
+    def clear(self):
+        """Remove all baselines, including the persisted ones.
+        """
+
+        self.baselines = {}
+        self.used = {}
+        self._changed = False
+        if self.path is not None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def save(self):
+        """Write the baselines to the JSON file, if anything changed.
+
+        The baselines of the files in :code:`used` are replaced by the used
+        ones, and the baselines of files that no longer exist are dropped.
+        """
+
+        for file, baselines in self.used.items():
+            if self.baselines.get(file, {}).keys() != baselines.keys():
+                self._changed = True
+            self.baselines[file] = baselines
+        for file in list(self.baselines.keys()):
+            if file != '' and not os.path.exists(file):
+                del self.baselines[file]
+                self._changed = True
+        if self.path is not None and self._changed:
+            vishack.core.state.save_state(self.path, self.baselines)
+        self.used = {}
+        self._changed = False
+
+
+def hash_references(references):
+    """Hash the reference data.
+
+    Parameters
+    ----------
+    references: list of arrays
+        The reference data.
+
+    Returns
+    -------
+    string
+        The SHA-1 hex digest of the dtypes, shapes and bytes of the arrays.
+    """
+
+    sha1 = hashlib.sha1()
+    for reference in references:
+        reference = np.ascontiguousarray(reference)
+        sha1.update('{}{}'.format(reference.dtype.str, reference.shape)
+            .encode())
+        sha1.update(reference.tobytes())
+    return(sha1.hexdigest())
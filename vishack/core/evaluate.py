@@ -3,6 +3,12 @@
 
 import numpy as np
 
+from vishack.logger import logger
+
+# The maximum relative deviation of single precision evaluations from double
+# precision ones before a warning is logged with precision='check'.
+single_precision_tolerance = 1e-4
+
 def wrms(data, df=1., whitening=None):
     """Whiten the data and calcuate the expected root-mean-square value.
 
@@ -29,14 +35,14 @@ def wrms(data, df=1., whitening=None):
     will be the 2-norm.
     """
 
-    data = np.array(data[1:])
+    data = np.asarray(data)[1:]
 
     if whitening is None:
-        whitening = np.ones(len(data))
+        # Same precision as whitening with an array of float64 ones.
+        wdata = np.abs(data.astype(np.result_type(data, np.float64)))
     else:
-        whitening = np.array(whitening[1:])
-
-    wdata = np.abs(data*whitening)
+        whitening = np.asarray(whitening)[1:]
+        wdata = np.abs(data*whitening)
     wrms_ = np.sqrt(np.sum(wdata**2*df))
 
     return(wrms_)
@@ -83,8 +89,8 @@ def wmse(data, reference):
         by the inverse of the reference.
     """
 
-    data = np.array(data[1:])
-    reference = np.array(reference[1:])
+    data = np.asarray(data)[1:]
+    reference = np.asarray(reference)[1:]
     werror = np.abs((data-reference)/reference)
     wmse_ = np.mean(werror**2)
     return(wmse_)
@@ -105,8 +111,8 @@ def mse(data, reference):
         The mean-square-error between the data and the reference.
     """
 
-    data = np.array(data[1:])
-    reference = np.array(reference[1:])
+    data = np.asarray(data)[1:]
+    reference = np.asarray(reference)[1:]
     error = np.abs((data-reference))
     mse_ = np.mean(error**2)
     return(mse_)
@@ -128,8 +134,8 @@ def wmae(data, reference):
         by the inverse of the reference.
     """
 
-    data = np.array(data[1:])
-    reference = np.array(reference[1:])
+    data = np.asarray(data)[1:]
+    reference = np.asarray(reference)[1:]
     werror = np.abs((data-reference)/reference)
     wmae_ = np.max(werror)
     return(wmae_)
@@ -150,8 +156,358 @@ def mae(data, reference):
         The maximum absolute error between the data and the reference
     """
 
-    data = np.array(data[1:])
-    reference = np.array(reference[1:])
+    data = np.asarray(data)[1:]
+    reference = np.asarray(reference)[1:]
     error = np.abs((data-reference))
     mae_ = np.max(error)
     return(mae_)
+
+def evaluate_batch(data, references, methods, df=1., precision='default',
+        workspace=None):
+    """Evaluate statistical quantities between data and many references.
+
+    Parameters
+    ----------
+    data: array
+        The data to be evaluated, with N data points.
+    references: array
+        The reference data, stacked with shape (R, N).
+        A list of R arrays is also accepted.
+    methods: list of strings
+        The quantities to be evaluated.
+        Options are 'RMS', 'WRMS', 'MSE', 'WMSE', 'MAE', 'WMAE'.
+    df: float, optional
+        The frequency spacing between data points. Default to be 1.
+        Only used when calculating RMS and WRMS.
+    precision: string, optional
+        'default' evaluates in the precision of the data and references,
+        promoted as NumPy does, like :code:`mse()` etc.
+        'single' evaluates in the single precision of diaggui data, i.e.
+        float32 and complex64, in the buffers of the workspace.
+        'double' casts the data and references to float64 or complex128
+        first.
+        'check' compares 'single' with 'double', logs a warning if they
+        differ by more than :code:`single_precision_tolerance` and returns
+        the 'default' values.
+        Defaults to 'default'.
+    workspace: Workspace, optional
+        The buffers reused by the single precision evaluations.
+        If None, new buffers are used.
+        Defaults to None.
+
+    Returns
+    -------
+    dict
+        The evaluated quantities with the methods as the keys. Each value is
+        an array of length R, one for each reference.
+
+    Note
+    ----
+    This gives the same values as calling :code:`rms()`, :code:`wrms()`,
+    :code:`mse()`, :code:`wmse()`, :code:`mae()` and :code:`wmae()`
+    reference by reference, but the difference, absolute error and
+    whitened error are computed only once for all references and methods.
+    Unknown methods are ignored.
+    """
+
+    if precision == 'single':
+        return(_evaluate_batch_single(
+            data, references, methods, df=df, workspace=workspace))
+    elif precision == 'double':
+        data = np.asarray(data)
+        data = data.astype(np.result_type(data, np.float64))
+        is_complex = np.iscomplexobj(data) or any(
+            np.iscomplexobj(reference) for reference in references)
+        references = np.array(
+            references, dtype=np.complex128 if is_complex else np.float64)
+    elif precision == 'check':
+        deviations = compare_precision(
+            data, references, methods, df=df, workspace=workspace)
+        for method, deviation in deviations.items():
+            if deviation > single_precision_tolerance:
+                logger.warning('{} in single precision deviates from double '\
+                    'precision by {:.3g}.'.format(method, deviation))
+    elif precision != 'default':
+        raise ValueError('Unknown precision {}.'.format(precision))
+
+    data = np.asarray(data)[1:]
+    references = np.asarray(references)[:, 1:]
+    values = {}
+
+    if 'RMS' in methods:
+        # Same precision as wrms() without whitening, which is done with
+        # an array of float64 ones.
+        abs_data = np.abs(data.astype(np.result_type(data, np.float64)))
+        rms_ = np.sqrt(np.sum(abs_data**2*df))
+        values['RMS'] = np.full(len(references), rms_)
+    if 'WRMS' in methods:
+        wdata = np.abs(data*references)
+        values['WRMS'] = np.sqrt(np.sum(wdata**2*df, axis=1))
+
+    if any(method in methods for method in ['MSE', 'WMSE', 'MAE', 'WMAE']):
+        difference = data-references
+    if 'MSE' in methods or 'MAE' in methods:
+        error = np.abs(difference)
+        if 'MSE' in methods:
+            values['MSE'] = np.mean(error**2, axis=1)
+        if 'MAE' in methods:
+            values['MAE'] = np.max(error, axis=1)
+    if 'WMSE' in methods or 'WMAE' in methods:
+        werror = np.abs(difference/references)
+        if 'WMSE' in methods:
+            values['WMSE'] = np.mean(werror**2, axis=1)
+        if 'WMAE' in methods:
+            values['WMAE'] = np.max(werror, axis=1)
+
+    return(values)
+
+def _evaluate_batch_single(data, references, methods, df, workspace):
+    """evaluate_batch() in single precision with reusable buffers.
+
+    The data and references are sliced without copying, unless they have
+    to be cast or stacked. All (R, N) intermediates are computed in place
+    in two buffers of the workspace.
+    """
+
+    if workspace is None:
+        workspace = Workspace()
+    data = np.asarray(data)[1:]
+    if isinstance(references, np.ndarray):
+        is_complex = np.iscomplexobj(references)
+    else:
+        is_complex = any(
+            np.iscomplexobj(reference) for reference in references)
+    dtype = np.complex64 if is_complex or np.iscomplexobj(data) \
+        else np.float32
+    data = data.astype(dtype, copy=False)
+    n_ref = len(references)
+    n_point = len(data)
+    if isinstance(references, np.ndarray) and references.dtype == dtype:
+        references = references[:, 1:]
+    else:
+        stacked = workspace.buffer('references', (n_ref, n_point), dtype)
+        for i, reference in enumerate(references):
+            stacked[i] = np.asarray(reference)[1:]
+        references = stacked
+    values = {}
+
+    if 'RMS' in methods:
+        abs_data = np.abs(data)
+        rms_ = np.sqrt(np.sum(np.square(abs_data, out=abs_data))*df)
+        values['RMS'] = np.full(n_ref, rms_, dtype=np.float64)
+
+    difference = workspace.buffer('difference', (n_ref, n_point), dtype)
+    error = workspace.buffer('error', (n_ref, n_point), np.float32)
+    if 'WRMS' in methods:
+        np.multiply(data, references, out=difference)
+        np.abs(difference, out=error)
+        np.square(error, out=error)
+        values['WRMS'] = np.sqrt(np.sum(error, axis=1)*df)
+
+    if any(method in methods for method in ['MSE', 'WMSE', 'MAE', 'WMAE']):
+        np.subtract(data, references, out=difference)
+    if 'MSE' in methods or 'MAE' in methods:
+        np.abs(difference, out=error)
+        if 'MAE' in methods:
+            values['MAE'] = np.max(error, axis=1)
+        if 'MSE' in methods:
+            values['MSE'] = np.mean(np.square(error, out=error), axis=1)
+    if 'WMSE' in methods or 'WMAE' in methods:
+        np.divide(difference, references, out=difference)
+        np.abs(difference, out=error)
+        if 'WMAE' in methods:
+            values['WMAE'] = np.max(error, axis=1)
+        if 'WMSE' in methods:
+            values['WMSE'] = np.mean(np.square(error, out=error), axis=1)
+
+    for method in values.keys():
+        values[method] = values[method].astype(np.float64)
+    return(values)
+
+def compare_precision(data, references, methods, df=1., workspace=None):
+    """Compare the single precision evaluations to the double precision ones.
+
+    Parameters
+    ----------
+    data: array
+        The data to be evaluated, with N data points.
+    references: array
+        The reference data, stacked with shape (R, N).
+        A list of R arrays is also accepted.
+    methods: list of strings
+        The quantities to be evaluated.
+        Options are 'RMS', 'WRMS', 'MSE', 'WMSE', 'MAE', 'WMAE'.
+    df: float, optional
+        The frequency spacing between data points. Default to be 1.
+    workspace: Workspace, optional
+        The buffers reused by the single precision evaluations.
+        Defaults to None.
+
+    Returns
+    -------
+    dict
+        The maximum relative deviation of the single precision values from
+        the double precision values over the references, with the methods as
+        the keys.
+    """
+
+    double_values = evaluate_batch(
+        data, references, methods, df=df, precision='double')
+    single_values = evaluate_batch(
+        data, references, methods, df=df, precision='single',
+        workspace=workspace)
+    deviations = {}
+    for method in double_values.keys():
+        double = double_values[method]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            deviation = np.abs(single_values[method]-double)/np.abs(double)
+        deviation[double == 0] = np.abs(single_values[method])[double == 0]
+        deviations[method] = float(np.nanmax(deviation)) \
+            if len(deviation) > 0 else 0.
+    return(deviations)
+
+
+class Workspace:
+    """Buffers reused by single precision evaluations.
+
+    Each buffer grows to the largest size requested and views of it are
+    handed out, so evaluating many spectra allocates the (R, N)
+    intermediates only once.
+
+    Attributes
+    ----------
+    nbytes: int
+        The total size of the buffers in bytes.
+    """
+
+    def __init__(self):
+        """Initiate an empty Workspace.
+        """
+
+        self._buffers = {}
+
+    def buffer(self, name, shape, dtype):
+        """Return a buffer, which is overwritten by the next request.
+
+        Parameters
+        ----------
+        name: string
+            The name of the buffer.
+        shape: tuple of int
+            The shape of the buffer.
+        dtype: numpy.dtype
+            The data type of the buffer.
+
+        Returns
+        -------
+        array
+            An uninitialized view of the buffer with the shape.
+        """
+
+        dtype = np.dtype(dtype)
+        size = int(np.prod(shape))
+        key = (name, dtype)
+        if key not in self._buffers or self._buffers[key].size < size:
+            self._buffers[key] = np.empty(size, dtype=dtype)
+        return(self._buffers[key][:size].reshape(shape))
+
+    @property
+    def nbytes(self):
+        return(sum(buffer.nbytes for buffer in self._buffers.values()))
+
+def pairwise_evaluate(references, methods, df=1.):
+    """Evaluate statistical quantities between all pairs of references.
+
+    Parameters
+    ----------
+    references: array
+        The reference data, stacked with shape (R, N).
+        A list of R arrays is also accepted.
+    methods: list of strings
+        The quantities to be evaluated.
+        Options are 'RMS', 'WRMS', 'MSE', 'WMSE', 'MAE', 'WMAE'.
+    df: float, optional
+        The frequency spacing between data points. Default to be 1.
+        Only used when calculating RMS and WRMS.
+
+    Returns
+    -------
+    dict
+        The mean and the standard deviation of the evaluations over all
+        pairs, with the methods as the keys.
+
+    Note
+    ----
+    For each pair (i, j) with i < j, reference i is evaluated with
+    reference j as the reference, like :code:`mse(references[i],
+    references[j])`. The squared-error quantities are computed from Gram
+    matrices of the references in double precision. Pairs for which this
+    loses precision, e.g. nearly identical references, are evaluated
+    directly. Unknown methods are ignored.
+    """
+
+    references = np.asarray(references)[:, 1:]
+    references = references.astype(np.result_type(references, np.float64))
+    n_ref, n_point = references.shape
+    upper = np.triu_indices(n_ref, k=1)
+    values = {}
+
+    power = np.abs(references)**2
+    if 'RMS' in methods:
+        rms_ = np.sqrt(np.sum(power*df, axis=1))
+        values['RMS'] = np.broadcast_to(rms_[:, None], (n_ref, n_ref))[upper]
+    if 'WRMS' in methods:
+        values['WRMS'] = np.sqrt(np.abs(power@power.T)*df)[upper]
+    if 'MSE' in methods:
+        gram = np.real(references@references.conj().T)
+        scale = power.sum(axis=1)
+        scale = scale[:, None]+scale[None, :]
+        mse_ = (scale-2*gram)[upper]
+        values['MSE'] = _refine(
+            mse_, scale[upper], upper, references, weighted=False)/n_point
+    if 'WMSE' in methods:
+        inverse_power = 1/power
+        ratio_power = power@inverse_power.T
+        gram = np.real(
+            references@(references.conj()*inverse_power).T)
+        scale = (ratio_power+n_point)[upper]
+        wmse_ = (ratio_power-2*gram+n_point)[upper]
+        values['WMSE'] = _refine(
+            wmse_, scale, upper, references, weighted=True)/n_point
+    if 'MAE' in methods or 'WMAE' in methods:
+        mae_ = []
+        wmae_ = []
+        for i in range(n_ref-1):
+            difference = references[i]-references[i+1:]
+            if 'MAE' in methods:
+                mae_.append(np.max(np.abs(difference), axis=1))
+            if 'WMAE' in methods:
+                wmae_.append(
+                    np.max(np.abs(difference/references[i+1:]), axis=1))
+        if 'MAE' in methods:
+            values['MAE'] = np.concatenate(mae_) if mae_ else np.array([])
+        if 'WMAE' in methods:
+            values['WMAE'] = np.concatenate(wmae_) if wmae_ else np.array([])
+
+    stats = {}
+    for method in values.keys():
+        stats[method] = (np.mean(values[method]), np.std(values[method]))
+    return(stats)
+
+
+def _refine(values, scale, upper, references, weighted):
+    """Evaluate directly the pairs with cancellation in the Gram matrices.
+
+    Returns the summed squared (whitened) errors of the pairs.
+    """
+
+    tolerance = 1e-8
+    values = np.array(values)
+    for k in np.flatnonzero(values <= tolerance*scale):
+        i = upper[0][k]
+        j = upper[1][k]
+        difference = references[i]-references[j]
+        if weighted:
+            difference = difference/references[j]
+        values[k] = np.sum(np.abs(difference)**2)
+    return(values)
@@ -1,11 +1,23 @@
 """System checks (health checks) for KAGRA vibration isolation system
 """
 
+import concurrent.futures
 import configparser
-import dtt2hdf
+import contextlib
+import io
+import itertools
 import numpy as np
 import os
-import xml.etree
+import shutil
+import tempfile
+import threading
+import vishack.core.band
+import vishack.core.baseline
+import vishack.core.state
+import vishack.core.table
+import vishack.core.timing
+import vishack.data.cache
+import vishack.data.diag
 import vishack.data.diaggui
 import vishack.data.output
 import vishack.core.evaluate
@@ -14,6 +26,7 @@ from vishack.logger import logger
 
 default_header = '*This report is automatically generated by VISHack*\n\n'
 rst_content_string = '.. contents::\n   :depth: 4\n\n'
+evaluation_precisions = ('default', 'single', 'double', 'check')
 
 class HealthCheck:
     """Config driven health check class.
@@ -22,6 +35,17 @@ class HealthCheck:
     ----------
     config: string
         Path to the config file.
+    use_cache: boolean, optional
+        Use the on-disk diaggui cache specified in the [Cache] section
+        of the config file, if any.
+        Defaults to True.
+    clear_cache: boolean, optional
+        Clear the on-disk diaggui cache before reading any files.
+        Defaults to False.
+    timer: vishack.core.timing.StageTimer, optional
+        The timer of the stages of the health check.
+        If None, a new StageTimer is used.
+        Defaults to None.
 
     Attributes
     ----------
@@ -38,18 +62,38 @@ class HealthCheck:
     report_header: string
         The report message of the health check
     report: dict
-        The report of the health check
+        The report of the health check, a nested view of the table.
+    table: vishack.core.table.ResultTable
+        The results of the health check with one row per test and method.
+    timer: vishack.core.timing.StageTimer
+        The timer of the stages of the health check.
     """
 
-    def __init__(self, config):
+    def __init__(self, config, use_cache=True, clear_cache=False,
+            timer=None):
         """Initiate HealthCheck class with a config file.
 
         Parameters
         ----------
         config: string
             Path to the config file.
+        use_cache: boolean, optional
+            Use the on-disk diaggui cache specified in the [Cache] section
+            of the config file, if any.
+            Defaults to True.
+        clear_cache: boolean, optional
+            Clear the on-disk diaggui cache before reading any files.
+            Defaults to False.
+        timer: vishack.core.timing.StageTimer, optional
+            The timer of the stages of the health check.
+            If None, a new StageTimer is used.
+            Defaults to None.
         """
 
+        if timer is None:
+            timer = vishack.core.timing.StageTimer()
+        self.timer = timer
+
         if not os.path.exists(config):
             raise FileNotFoundError('{} not found.'.format(config))
 
@@ -65,12 +109,77 @@ class HealthCheck:
                 self._report_path = general['Report path']
                 self._overwrite_report = general.getboolean('Overwrite report', fallback=False)
             self.alert_threshold = general.getfloat('Alert threshold', fallback=3)
-
+            self._incremental = general.getboolean(
+                'Incremental', fallback=False)
+            self._report_timings = general.getboolean(
+                'Report timings', fallback=False)
+            self._evaluation_precision = general.get(
+                'Evaluation precision', fallback='default')
+            self._state_path = general.get(
+                'State path',
+                fallback=os.path.splitext(config)[0]+'_state.json')
+        else:
+            self._incremental = False
+            self._report_timings = False
+            self._evaluation_precision = 'default'
+        if self._evaluation_precision not in evaluation_precisions:
+            raise ValueError('Evaluation precision must be one of {}.'\
+                ''.format(', '.join(evaluation_precisions)))
+        # Buffers of the single precision evaluations.
+        self._workspace = vishack.core.evaluate.Workspace()
+
+        self._disk_cache = None
+        self._baseline_cache = vishack.core.baseline.BaselineCache()
+        if 'Cache' in self.config.sections():
+            cache_set = self.config['Cache']
+            if 'Directory' in cache_set:
+                disk_cache = vishack.data.cache.DiagguiCache(
+                    directory=cache_set['Directory'],
+                    size_limit=cache_set.getfloat(
+                        'Size limit (MB)',
+                        fallback=vishack.data.cache.default_size_limit))
+                if clear_cache:
+                    disk_cache.clear()
+                if use_cache:
+                    self._disk_cache = disk_cache
+            if 'Baseline path' in cache_set:
+                baseline_cache = vishack.core.baseline.BaselineCache(
+                    path=cache_set['Baseline path'])
+                if clear_cache:
+                    baseline_cache.clear()
+                if use_cache:
+                    self._baseline_cache = baseline_cache
+
+        self._diag_command = vishack.data.diag.default_command
+        self._concurrent_measurements = 1
+        self._measurement_timeout = None
+        if 'Measurement' in self.config.sections():
+            measurement_set = self.config['Measurement']
+            self._diag_command = measurement_set.get(
+                'Command', fallback=vishack.data.diag.default_command)
+            self._concurrent_measurements = measurement_set.getint(
+                'Concurrent measurements', fallback=1)
+            self._measurement_timeout = measurement_set.getfloat(
+                'Timeout (s)', fallback=None)
+
+        self._include_subfolder = False
+        self._include_patterns = None
+        self._exclude_patterns = None
+        self._discovery_threads = 1
         if 'Directory settings' in self.config.sections():
             dir_set = self.config['Directory settings']
             self._include_subfolder = (
                 dir_set.getboolean('Include subfolders', fallback=False))
-
+            if 'Include patterns' in dir_set:
+                self._include_patterns = (
+                    dir_set['Include patterns'].replace(' ', '').split(','))
+            if 'Exclude patterns' in dir_set:
+                self._exclude_patterns = (
+                    dir_set['Exclude patterns'].replace(' ', '').split(','))
+            self._discovery_threads = (
+                dir_set.getint('Discovery threads', fallback=1))
+
+        self._directories = []
         if 'Directories' in self.config.sections():
             self._directories = list(self.config['Directories'].keys())
             for directory in self._directories:
@@ -80,21 +189,20 @@ class HealthCheck:
                     self._directories.remove(directory)
 
         self.paths = []
-        if self._include_subfolder:
-            for directory in self._directories:
-                for (root, _, files) in os.walk(directory):
-                    for file in files:
-                        path = os.path.join(root, file)
-                        self._try_read_diaggui(path)
-        else:
-            for directory in self._directories:
-                for file in os.listdir(directory):
-                    path = os.path.join(directory, file)
-                    self._try_read_diaggui(path)
+        # Only the files that look like diaggui XML files are kept. They are
+        # parsed when they are checked.
+        with self.timer.stage('discovery'):
+            for path in vishack.data.diaggui.find_diaggui(
+                    directories=self._directories,
+                    include_subfolders=self._include_subfolder,
+                    include=self._include_patterns,
+                    exclude=self._exclude_patterns,
+                    threads=self._discovery_threads):
+                self._add_path(path, sniffed=True)
 
         if 'Paths' in self.config.sections():
             for path in list(self.config['Paths'].keys()):
-                self._try_read_diaggui(path)
+                self._add_path(path)
 
         self._remove_duplicated_paths()
 
@@ -110,6 +218,7 @@ class HealthCheck:
             if type in self.config.sections():
                 self.checklist[type]['check'] = self.config[type].getboolean('check', fallback=False)
                 self.checklist[type]['methods'] = self.config[type]['methods'].replace(' ', '').split(',')
+                self.checklist[type]['bands'] = self._read_bands(type)
 
         self.report_header = default_header
         self.report_header += 'Configuration:\n{}'.format(self.config_path)+'\n\n'
@@ -117,6 +226,7 @@ class HealthCheck:
         for path in self.paths:
             self.report_header += path + '\n\n'
         self.report_header += rst_content_string
+        self.table = vishack.core.table.ResultTable()
         self.report = {}
         self.alert = {}
 
@@ -125,18 +235,26 @@ class HealthCheck:
             typelist=[
                 'Transfer function',
                 'Power spectral density',
-                'Coherence']):
+                'Coherence'],
+            jobs=1):
         """Perform diagnosis checks (health checks).
 
         Parameters
         ---------
         new_measurement: boolean, optional.
             Trigger new measurement using the diaggui XML file.
+            Each file is checked as soon as it is measured, while the
+            next measurements are running.
             Default False.
         typelist: list of string, optional.
             The type of checks to be performed.
             Defaults to check all transfer functions, power spectral density,
             and coherence in the diaggui XML file.
+        jobs: int, optional.
+            The number of processes used to check the diaggui XML files
+            in parallel. Each file is parsed by the process that checks it.
+            If 1 or None, the files are checked in this process.
+            Defaults to 1.
 
         Returns
         -------
@@ -149,71 +267,361 @@ class HealthCheck:
         in the configuration file. If you wish to perform a particular type
         of tests, you must specify in the configuration file as well as
         specifying here.
+
+        The time spent is recorded in :code:`self.timings`.
         """
 
+        with self.timer.stage('check'):
+            return(self._check(new_measurement, typelist, jobs))
+
+    @property
+    def timings(self):
+        """The time, count and peak memory of the stages of the health check.
+
+        The stages are "discovery", "parsing", "reference matching",
+        "evaluation", "alerting", "report", "measurement" and "check", which
+        includes the other stages of :code:`check()`. The totals add up
+        over the lifetime of the instance, see
+        :code:`vishack.core.timing.StageTimer`.
+
+        Returns
+        -------
+        dict
+            The totals of each stage under "Stages", of each stage of each
+            file under "Files", the numbers of files, tests and alerts under
+            "Counts", and the maximum resident set size of the process
+            under "Max RSS (B)".
+        """
+
+        timings = self.timer.summary()
+        timings['Counts'] = {
+            'Files': len(self.paths),
+            'Tests': len(set(self.table['Test ID'])),
+            'Alerts': sum(len(self.alert[path][type])
+                for path in self.alert.keys()
+                for type in self.alert[path].keys()),
+        }
+        timings['Max RSS (B)'] = vishack.core.timing.max_rss()
+        return(timings)
+
+    def _check(self, new_measurement, typelist, jobs):
+        """Perform the health checks, see :code:`check()`."""
+
+        self.table = vishack.core.table.ResultTable()
         self.report = {}
-        id = 0
 
-        for path in self.paths:
+        # In incremental mode, files and config sections that haven't
+        # changed since the last check reuse the stored reports.
+        reused_reports = {}
+        if self._incremental:
+            state = vishack.core.state.load_state(self._state_path)
+            config_hash = self._config_hash(typelist)
+            content_hashes = {}
+            if not new_measurement:
+                for path in self.paths:
+                    content_hashes[path] = vishack.core.state.hash_file(path)
+                    if path in state.keys():
+                        if (state[path]['Content hash']
+                                == content_hashes[path]
+                                and state[path]['Config hash']
+                                == config_hash):
+                            reused_reports[path] = state[path]['Report']
+            logger.info('{} of {} diaggui files unchanged since the last '\
+                'check.'.format(len(reused_reports), len(self.paths)))
+        paths = [path for path in self.paths if path not in reused_reports]
+        if new_measurement:
+            evaluated_reports = self._measure_and_evaluate_paths(
+                paths, typelist=typelist, jobs=jobs)
+        else:
+            evaluated_reports = self._evaluate_paths(
+                paths, typelist=typelist, jobs=jobs)
+
+        # The detailed report is written file by file while checking so
+        # the whole report is never held as a string. The temporary file is
+        # removed when closed, also if the check fails.
+        with contextlib.ExitStack() as stack:
+            detailed_report = None
+            if self._output_report:
+                detailed_report = stack.enter_context(
+                    tempfile.TemporaryFile(mode='w+'))
+
+            # Test IDs are numbered in the order of self.paths so they don't
+            # depend on the order in which the files are checked.
+            new_state = {}
+            id = 0
+            for path in self.paths:
+                if path in reused_reports.keys():
+                    path_report = reused_reports[path]
+                else:
+                    _, path_report = next(evaluated_reports)
+                self.table.add_section(path)
+                for type in path_report.keys():
+                    self.table.add_section(path, type)
+                    for entry in path_report[type]:
+                        self.table.add_test(path, type, id, entry)
+                        id += 1
+                self.report[path] = self.table.to_report(path)[path]
+                if self._incremental:
+                    if path not in content_hashes.keys():
+                        # New measurements change the files.
+                        content_hashes[path] = (
+                            vishack.core.state.hash_file(path))
+                    new_state[path] = {
+                        'Content hash': content_hashes[path],
+                        'Config hash': config_hash,
+                        'Report': path_report,
+                    }
+                if detailed_report is not None:
+                    with self.timer.stage('report', path):
+                        self.write_dict(
+                            detailed_report, {path: self.report[path]})
+
+            self._baseline_cache.save()
+            if self._incremental:
+                vishack.core.state.save_state(self._state_path, new_state)
+
+            self.get_alerts(threshold=self.alert_threshold)
+            if self._output_report:
+                self.print_report(
+                    path=self._report_path,
+                    overwrite=self._overwrite_report,
+                    detailed_report=detailed_report)
+        return (self.report)
 
-            self.report[path] = {}
+    def _config_hash(self, typelist):
+        """Hash the config sections that affect the report of a file."""
+        sections = {}
+        for type in typelist:
+            if type in self.config.sections():
+                sections[type] = dict(self.config[type])
+            else:
+                sections[type] = None
+        if self._evaluation_precision != 'default':
+            sections['Evaluation precision'] = self._evaluation_precision
+        for type in typelist:
+            for band in self.checklist.get(type, {}).get('bands', []):
+                section = 'Band {}'.format(band.name)
+                sections[section] = dict(self.config[section])
+        return(vishack.core.state.hash_object(sections))
 
-            dg = vishack.data.diaggui.Diaggui(path)
-            if new_measurement:
-                dg.measure()
+    def measure(self, paths=None):
+        """Trigger new measurements using the diaggui XML files.
 
-            for type in typelist:
-                if type in self.checklist.keys():
-                    if self.checklist[type]['check']:
+        The measurements are run concurrently as specified in the
+        [Measurement] section of the config file.
 
-                        self.report[path][type] = {}
+        Parameters
+        ----------
+        paths: list of strings, optional
+            The paths of the diaggui XML files to be measured.
+            If None, all files in :code:`self.paths` are measured.
+            Defaults to None.
 
-                        methods = self.checklist[type]['methods']
-                    else:
-                        continue
-                    if type == 'Transfer function':
-                        type_name = 'CSD'
-                        reference_key = 'xfer'
-                    elif type == 'Power spectral density':
-                        type_name = 'PSD'
-                        reference_key = 'PSD'
-                    elif type == 'Coherence':
-                        type_name = 'COH'
-                        reference_key = 'coherence'
+        Returns
+        -------
+        dict
+            The vishack.data.diag.MeasurementError of each path whose
+            measurement failed. These files are checked with the results
+            they had before.
+        """
+
+        if paths is None:
+            paths = self.paths
+        with self.timer.stage('measurement'):
+            errors = self._measurement_scheduler().run(paths)
+        self._log_measurement_errors(errors, paths)
+        return(errors)
+
+    def _measurement_scheduler(self):
+        """Return a MeasurementScheduler as specified in the config."""
+        return(vishack.data.diag.MeasurementScheduler(
+            max_concurrent=self._concurrent_measurements,
+            timeout=self._measurement_timeout,
+            command=self._diag_command))
+
+    def _log_measurement_errors(self, errors, paths):
+        if len(errors) > 0:
+            logger.warning('{} of {} measurements failed. The files are '\
+                'checked with their old results.'\
+                ''.format(len(errors), len(paths)))
+
+    def _measure_and_evaluate_paths(self, paths, typelist, jobs):
+        """Measure files and check them, yielding the paths and reports in
+        order.
+
+        The measurements run in a background thread. Each measured file is
+        submitted for evaluation right away, to a worker thread, or to a
+        pool of processes if jobs > 1, so the files are evaluated while the
+        next ones are measured. Running the subprocesses from a background
+        thread needs the default asyncio child watcher of Python 3.8.
+        """
+        use_processes = jobs is not None and jobs > 1
+        if use_processes:
+            executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=jobs)
+        else:
+            # A single worker keeps the evaluations in order, as in
+            # _evaluate_paths().
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        # Futures of the evaluation futures, set when a file is measured.
+        submitted = {path: concurrent.futures.Future() for path in paths}
+
+        def submit(path, error):
+            # Called by the scheduler in the event loop, which only logs
+            # exceptions, so they are passed to the waiting thread instead,
+            # e.g. BrokenProcessPool if a worker died.
+            try:
+                if use_processes:
+                    future = executor.submit(
+                        _check_path_job, self._worker_state(), path,
+                        typelist, self._baseline_cache.for_file(path))
+                else:
+                    future = executor.submit(
+                        self._check_path, path, typelist)
+            except BaseException as e:
+                submitted[path].set_exception(e)
+            else:
+                submitted[path].set_result(future)
+
+        scheduler = self._measurement_scheduler()
+        errors = {}
+
+        def measure():
+            try:
+                with self.timer.stage('measurement'):
+                    errors.update(scheduler.run(paths, callback=submit))
+            except BaseException as e:
+                for future in submitted.values():
+                    if not future.done():
+                        future.set_exception(e)
+                raise
+
+        measurement = threading.Thread(target=measure)
+        measurement.start()
+        try:
+            for path in paths:
+                result = submitted[path].result().result()
+                if use_processes:
+                    path_report, baselines, timings = result
+                    self._baseline_cache.update(baselines)
+                    self.timer.merge(timings)
+                else:
+                    path_report = result
+                yield(path, path_report)
+        except BaseException:
+            scheduler.cancel()
+            for future in submitted.values():
+                if future.done() and future.exception() is None:
+                    future.result().cancel()
+            raise
+        finally:
+            measurement.join()
+            executor.shutdown()
+        self._log_measurement_errors(errors, paths)
+
+    def _evaluate_paths(self, paths, typelist, jobs):
+        """Check files, yielding the paths and reports in order."""
+        if jobs is not None and jobs > 1:
+            with concurrent.futures.ProcessPoolExecutor(
+                    max_workers=jobs) as executor:
+                for path, (path_report, baselines, timings) in zip(
+                        paths, executor.map(
+                            _check_path_job,
+                            itertools.repeat(self._worker_state()), paths,
+                            itertools.repeat(typelist),
+                            [self._baseline_cache.for_file(path)
+                                for path in paths])):
+                    self._baseline_cache.update(baselines)
+                    self.timer.merge(timings)
+                    yield(path, path_report)
+        else:
+            for path in paths:
+                yield(path, self._check_path(path, typelist))
+
+    def _check_path(self, path, typelist):
+        """Perform health checks on one diaggui XML file.
+
+        Parameters
+        ----------
+        path: string
+            The path of the diaggui XML file.
+        typelist: list of string
+            The type of checks to be performed.
+
+        Returns
+        -------
+        report: dict
+            The report of the file, with the list of tests of each type.
+        """
+
+        report = {}
+        # The slices of the frequency bands of each frequency axis in the
+        # file, found once.
+        slices = {}
+
+        dg = self._get_diaggui(path)
+        if dg is None:
+            return(report)
+        self._baseline_cache.start(path)
+
+        for type in typelist:
+            if type in self.checklist.keys():
+                if self.checklist[type]['check']:
+
+                    report[type] = []
+
+                    methods = self.checklist[type]['methods']
+                    bands = self.checklist[type]['bands']
                 else:
-                    logger.error('Unknown type {}. Ignoring...'\
-                        ''.format(type))
                     continue
+                if type == 'Transfer function':
+                    type_name = 'CSD'
+                    reference_key = 'xfer'
+                elif type == 'Power spectral density':
+                    type_name = 'PSD'
+                    reference_key = 'PSD'
+                elif type == 'Coherence':
+                    type_name = 'COH'
+                    reference_key = 'coherence'
+            else:
+                logger.error('Unknown type {}. Ignoring...'\
+                    ''.format(type))
+                continue
+
+            used_index = set()
+            results = dg.get_results(type_name)
+            for channel_a in results.keys():
+                if 'channelB' in results[channel_a]:
+                    for channel_b in results[channel_a]['channelB']:
+                        # See if any references matches the type and channels
+                        with self.timer.stage('reference matching', path):
+                            matching_index = [
+                                ref_index for ref_index in dg.find_references(
+                                    reference_key, channel_a, channel_b)
+                                if ref_index not in used_index]
 
-                ref_index_list = list(dg.items.references.keys())
-                results = dg.get_results(type_name)
-                for channel_a in results.keys():
-                    if 'channelB' in results[channel_a]:
-                        for channel_b in results[channel_a]['channelB']:
-                            matching_index = []
-                            # See if any references matches the type and channels
-                            for ref_index in ref_index_list:
-                                ref_dict = dg.get_reference(ref_index)
-                                if reference_key in ref_dict.keys():
-                                    if ref_dict['channelA'] == channel_a:
-                                        if channel_b in ref_dict['channelB']:
-                                            matching_index.append(ref_index)
-
-                            # We don't compare if the number of references
-                            # is smaller than 2.
-                            if len(matching_index) < 2:
-                                continue
-
-                            # If it matches, then we don't check it next time.
-                            for index in matching_index:
-                                ref_index_list.remove(index)
-
-                            self.report[path][type][id] = {}
-                            self.report[path][type][id]['References'] = matching_index
+                        # We don't compare if the number of references
+                        # is smaller than 2.
+                        if len(matching_index) < 2:
+                            continue
 
+                        # If it matches, then we don't check it next time.
+                        used_index.update(matching_index)
+
+                        entry = {}
+                        entry['References'] = matching_index
+
+                        with self.timer.stage('evaluation', path):
                             if type == 'Transfer function':
-                                f, result_data = dg.tf(channel_a, channel_b)
-                                result_data = result_data.conjugate()
+                                # Written in a buffer reused by all tests.
+                                _, csd_data = dg.csd(channel_a, channel_b)
+                                _, psd_data = dg.psd(channel_a)
+                                buffer = self._workspace.buffer(
+                                    'transfer function', csd_data.shape,
+                                    np.result_type(csd_data, psd_data))
+                                f, result_data = dg.tf(
+                                    channel_a, channel_b, out=buffer)
+                                np.conjugate(result_data, out=result_data)
                             elif type == 'Power spectral density':
                                 f, result_data = dg.psd(channel_a)
                                 print('If you see this message,'\
@@ -221,50 +629,41 @@ class HealthCheck:
                             elif type == 'Coherence':
                                 f, result_data = dg.coh(channel_a, channel_b)
 
-                            ref_data = [dg.get_reference(index)[reference_key][0]
+                            ref_data = [dg.get_reference_data(index, reference_key)
                                 for index in matching_index]
 
                             df = dg.get_results(type_name)[channel_a]['df']
 
-                            self.report[path][type][id]['Channel A'] = channel_a
-                            self.report[path][type][id]['Channel B'] = channel_b
-
-                            for method in methods:
-                                data_mean, _ = self.data_evaluate(
-                                    result_data, ref_data, method=method,
-                                    df=df)
-                                ref_mean, ref_std = self.reference_evaluate(
-                                    ref_data, method=method, df=df)
+                            entry['Channel A'] = channel_a
+                            entry['Channel B'] = channel_b
 
-                                self.report[path][type][id][method] = {}
-                                self.report[path][type][id][method]['Reference mean'] = ref_mean
-                                self.report[path][type][id][method]['Reference standard deviation'] = ref_std
-                                self.report[path][type][id][method]['Result (raw)'] = data_mean
-                                self.report[path][type][id][method]['Result (sigma)'] = (data_mean-ref_mean) / ref_std
+                            entries = self._evaluate_test(
+                                path, entry, f, result_data, ref_data,
+                                methods=methods, df=df, bands=bands,
+                                slices=slices)
 
-                            id += 1
+                        report[type] += entries
 
-                    else:
-                        matching_index = []
-                        # See if any references matches the type and channels
-                        for ref_index in ref_index_list:
-                            ref_dict = dg.get_reference(ref_index)
-                            if reference_key in ref_dict.keys():
-                                if ref_dict['channelA'] == channel_a:
-                                    matching_index.append(ref_index)
-
-                        # We don't compare if the number of references
-                        # is smaller than 2.
-                        if len(matching_index) < 2:
-                            continue
+                else:
+                    # See if any references matches the type and channels
+                    with self.timer.stage('reference matching', path):
+                        matching_index = [
+                            ref_index for ref_index in dg.find_references(
+                                reference_key, channel_a)
+                            if ref_index not in used_index]
+
+                    # We don't compare if the number of references
+                    # is smaller than 2.
+                    if len(matching_index) < 2:
+                        continue
 
-                        # If it matches, then we don't check it next time.
-                        for index in matching_index:
-                            ref_index_list.remove(index)
+                    # If it matches, then we don't check it next time.
+                    used_index.update(matching_index)
 
-                        self.report[path][type][id] = {}
-                        self.report[path][type][id]['References'] = matching_index
+                    entry = {}
+                    entry['References'] = matching_index
 
+                    with self.timer.stage('evaluation', path):
                         if type == 'Transfer function':
                             f, result_data = dg.tf(channel_a, channel_b)
                         elif type == 'Power spectral density':
@@ -272,34 +671,149 @@ class HealthCheck:
                         elif type == 'Coherence':
                             f, result_data = dg.coh(channel_a, channel_b)
 
-                        ref_data = [dg.get_reference(index)[reference_key][0]
+                        ref_data = [dg.get_reference_data(index, reference_key)
                             for index in matching_index]
 
                         df = dg.get_results(type_name)[channel_a]['df']
 
-                        self.report[path][type][id]['Channel A'] = channel_a
+                        entry['Channel A'] = channel_a
 
-                        for method in methods:
-                            data_mean, _ = self.data_evaluate(
-                                result_data, ref_data, method=method,
-                                df=df)
-                            ref_mean, ref_std = self.reference_evaluate(
-                                ref_data, method=method, df=df)
+                        entries = self._evaluate_test(
+                            path, entry, f, result_data, ref_data,
+                            methods=methods, df=df, bands=bands,
+                            slices=slices)
 
-                            self.report[path][type][id][method] = {}
-                            self.report[path][type][id][method]['Reference mean'] = ref_mean
-                            self.report[path][type][id][method]['Reference standard deviation'] = ref_std
-                            self.report[path][type][id][method]['Result (raw)'] = data_mean
-                            self.report[path][type][id][method]['Result (sigma)'] = (data_mean-ref_mean) / ref_std
+                    report[type] += entries
 
-                        id += 1
+        return(report)
 
-        self.get_alerts(threshold=self.alert_threshold)
-        if self._output_report:
-            self.print_report(
-                path=self._report_path,
-                overwrite=self._overwrite_report)
-        return (self.report)
+    def _evaluate_test(self, path, test, f, result_data, ref_data, methods,
+            df, bands, slices):
+        """Evaluate a test over the full spectrum or in frequency bands.
+
+        Parameters
+        ----------
+        path: string
+            The path of the diaggui XML file.
+        test: dict
+            The entry of the test with keys 'References', 'Channel A' and
+            optionally 'Channel B'.
+        f: array
+            The frequency axis of the data.
+        result_data: array
+            The data to be evaluated.
+        ref_data: list of arrays
+            The reference data.
+        methods: list of strings
+            The quantities to be evaluated.
+        df: float
+            The frequency spacing between data points.
+        bands: list of vishack.core.band.FrequencyBand
+            The frequency bands of the type of the test.
+        slices: dict
+            The slices of the bands of each frequency axis found so far in
+            the file, updated with the ones of f.
+
+        Returns
+        -------
+        list of dicts
+            The entries of the test, one for each band that applies to the
+            channels, with the band name under 'Band', or one over the full
+            spectrum if no band applies.
+        """
+
+        channel_b = test.get('Channel B')
+        applied = [band for band in bands
+            if band.applies_to(test['Channel A'], channel_b)]
+        if len(applied) == 0:
+            return([self._evaluate_entry(
+                path, test, result_data, ref_data, methods=methods, df=df)])
+
+        # Band names are unique, so the slices of all types are kept
+        # together.
+        axis_slices = slices.setdefault(
+            (len(f), float(f[0]), float(f[-1])), {})
+        entries = []
+        for band in applied:
+            if band.name not in axis_slices.keys():
+                axis_slices[band.name] = band.bins(f)
+            bins = axis_slices[band.name]
+            if bins is None:
+                logger.warning('No frequency bins of {} in band {}. '\
+                    'Ignoring...'.format(test['Channel A'], band.name))
+                continue
+            entry = dict(test)
+            entry['Band'] = band.name
+            # Slices are views, so the data are not copied.
+            entries.append(self._evaluate_entry(
+                path, entry, result_data[bins],
+                [reference[bins] for reference in ref_data],
+                methods=methods, df=df))
+        return(entries)
+
+    def _evaluate_entry(self, path, entry, result_data, ref_data, methods,
+            df):
+        """Add the results of the methods to the entry of a test."""
+        data_values = vishack.core.evaluate.evaluate_batch(
+            result_data, ref_data, methods=methods, df=df,
+            precision=self._evaluation_precision,
+            workspace=self._workspace)
+        ref_stats = self._baseline_cache.evaluate(
+            ref_data, methods=methods, df=df, file=path)
+
+        for method in methods:
+            if method not in data_values:
+                logger.error('Method {} not available. '\
+                    'Ignoring...'.format(method))
+                continue
+            data_mean = np.mean(data_values[method])
+            ref_mean, ref_std = ref_stats[method]
+
+            entry[method] = {}
+            entry[method]['Reference mean'] = ref_mean
+            entry[method]['Reference standard deviation'] = ref_std
+            entry[method]['Result (raw)'] = data_mean
+            entry[method]['Result (sigma)'] = (data_mean-ref_mean) / ref_std
+        return(entry)
+
+    def _read_bands(self, type):
+        """Read the frequency bands listed in the section of a type."""
+        bands = []
+        if 'bands' not in self.config[type]:
+            return(bands)
+        for name in self.config[type]['bands'].split(','):
+            name = name.strip()
+            if name == '':
+                continue
+            section = 'Band {}'.format(name)
+            if section not in self.config.sections():
+                raise ValueError('Band {} of {} has no section [{}].'\
+                    ''.format(name, type, section))
+            band_set = self.config[section]
+            channels = None
+            if 'Channels' in band_set:
+                channels = band_set['Channels'].replace(' ', '').split(',')
+            bands.append(vishack.core.band.FrequencyBand(
+                name,
+                lower=band_set.getfloat('Lower frequency (Hz)', fallback=0.),
+                upper=band_set.getfloat(
+                    'Upper frequency (Hz)', fallback=np.inf),
+                channels=channels))
+        return(bands)
+
+    def _worker_state(self):
+        """Return the attributes needed to check files in worker processes.
+
+        Only these are sent to the workers, not the config, report and
+        alerts, see :code:`_check_path_job()`.
+        """
+        return({
+            'checklist': self.checklist,
+            '_disk_cache': self._disk_cache,
+            # Pickled as an empty timer, see StageTimer.__getstate__().
+            'timer': self.timer,
+            '_evaluation_precision': self._evaluation_precision,
+        })
 
     def get_alerts(self, threshold=3):
         """ Store alerting results from report
@@ -317,28 +831,13 @@ class HealthCheck:
             Some alerting results from the health check report.
         """
 
-        self.alert = {}
-        alert = False
-        for path in self.report.keys():
-            for type in self.report[path].keys():
-                for id in self.report[path][type].keys():
-                    for method in self.report[path][type][id].keys():
-                        if isinstance(self.report[path][type][id][method], dict):
-                            if 'Result (sigma)' in self.report[path][type][id][method].keys():
-                                if abs(self.report[path][type][id][method]['Result (sigma)']) >= threshold:
-                                    # print(id)
-                                    alert = True
-                    if alert:
-                        if not (path in self.alert.keys()):
-                            self.alert[path]={}
-                        if not (type in self.alert[path].keys()):
-                            self.alert[path][type]={}
-                        self.alert[path][type][id]=dict(self.report[path][type][id])
-                        alert = False  # Resets for each id.
+        with self.timer.stage('alerting'):
+            mask = self.table.alert_mask(threshold=threshold)
+            self.alert = self.table.select(mask).to_report()
 
         return (self.alert)
 
-    def print_report(self, path, overwrite=False):
+    def print_report(self, path, overwrite=False, detailed_report=None):
         """Write health check report to file with human readable format.
 
         Parameters
@@ -348,22 +847,27 @@ class HealthCheck:
         overwrite: boolean, optional
             Overwrite existing file. If false, path will be renamed before
             writing the report.
-
-        Returns
-        -------
-        full_string: string
-            The full string of the report.
+        detailed_report: file object, optional
+            The detailed report already written with :code:`write_dict()`,
+            e.g. while checking. It is copied to the report after the alerts.
+            If None, the detailed report is written from the report.
+            Defaults to None.
         """
 
         if not overwrite:
             path = vishack.data.output.rename(path, method='utc')
 
-        default_string = self.report_header
-        alert_string = self.alert_to_string()
-        report_string = self.report_to_string()
-        full_string = default_string+alert_string+report_string
-        with open(path, 'w') as f:
-            f.write(full_string)
+        with self.timer.stage('report'), open(path, 'w') as f:
+            f.write(self.report_header)
+            self.write_alert(f)
+            if detailed_report is None:
+                self.write_report(f)
+            else:
+                self._write_title(f, 'Health Check Detailed Report')
+                detailed_report.seek(0)
+                shutil.copyfileobj(detailed_report, f)
+            if self._report_timings:
+                self.write_timings(f)
 
     def alert_to_string(self):
         """Convert alert dictionary to human readable string
@@ -374,18 +878,9 @@ class HealthCheck:
             The human readable alert string
         """
 
-        title = 'Alert Report'
-        alert_string = title
-        alert_string += '\n'
-        alert_string += '='*len(title)
-        alert_string += '\n\n'
-        string = self.dict_to_string(self.alert)
-        if string == '':
-            alert_string += ('**No Alerts. VISHack cannot detect any '\
-                'problems.**\n\nFor detailed report, check below.\n\n')
-        else:
-            alert_string += string
-        return alert_string
+        f = io.StringIO()
+        self.write_alert(f)
+        return(f.getvalue())
 
     def report_to_string(self):
         """Convert health check report dictionary to human readable string
@@ -396,13 +891,9 @@ class HealthCheck:
             The human readable report string
         """
 
-        title = 'Health Check Detailed Report'
-        report_string = title
-        report_string += '\n'
-        report_string += '='*len(title)
-        report_string += '\n\n'
-        report_string += self.dict_to_string(self.report)
-        return report_string
+        f = io.StringIO()
+        self.write_report(f)
+        return(f.getvalue())
 
     def dict_to_string(self, dictionary):
         """Turns a report type dictionary to human readable string (rst)
@@ -418,36 +909,123 @@ class HealthCheck:
             The string in reStructuredText format.
         """
 
-        rst_string = ''
+        f = io.StringIO()
+        self.write_dict(f, dictionary)
+        return(f.getvalue())
+
+    def write_alert(self, f):
+        """Write alert dictionary in human readable format to a file object
+
+        Parameters
+        ----------
+        f: file object
+            The file object to be written, opened in text mode.
+        """
+
+        self._write_title(f, 'Alert Report')
+        if len(self.alert) == 0:
+            f.write('**No Alerts. VISHack cannot detect any '\
+                'problems.**\n\nFor detailed report, check below.\n\n')
+        else:
+            self.write_dict(f, self.alert)
+
+    def write_report(self, f):
+        """Write health check report in human readable format to a file object
+
+        Parameters
+        ----------
+        f: file object
+            The file object to be written, opened in text mode.
+        """
+
+        self._write_title(f, 'Health Check Detailed Report')
+        self.write_dict(f, self.report)
+
+    def write_timings(self, f):
+        """Write the timings of the stages in human readable format to a file
+        object
+
+        Parameters
+        ----------
+        f: file object
+            The file object to be written, opened in text mode.
+        """
+
+        timings = self.timings
+        self._write_title(f, 'Timings')
+        for key, value in timings['Counts'].items():
+            f.write('-\t{}:\t{}\n'.format(key, value))
+        if timings['Max RSS (B)'] is not None:
+            f.write('-\tMax RSS (MB):\t{:.1f}\n'.format(
+                timings['Max RSS (B)']/1e6))
+        f.write('\n')
+        f.write('Stages\n------\n\n')
+        self._write_stage_totals(f, timings['Stages'])
+        for path in timings['Files'].keys():
+            f.write(path)
+            f.write('\n')
+            f.write('-'*len(path))
+            f.write('\n\n')
+            self._write_stage_totals(f, timings['Files'][path])
+
+    def _write_stage_totals(self, f, stages):
+        for name, totals in stages.items():
+            line = '-\t{}:\t{:.4g} s in {} call(s)'.format(
+                name, totals['Time (s)'], totals['Count'])
+            if totals['Peak memory (B)'] is not None:
+                line += ', peak memory {:.3g} MB'.format(
+                    totals['Peak memory (B)']/1e6)
+            f.write(line)
+            f.write('\n')
+        f.write('\n')
+
+    def write_dict(self, f, dictionary):
+        """Write a report type dictionary in reStructuredText to a file object
+
+        Sections are written one by one as they are formatted.
+
+        Parameters
+        ----------
+        f: file object
+            The file object to be written, opened in text mode.
+        dictionary: dict
+            The health check report or the alert
+        """
+
         for path in dictionary.keys():
-            rst_string += path
-            rst_string += '\n'
-            rst_string += '-'*len(path)
-            rst_string += '\n\n'
+            f.write(path)
+            f.write('\n')
+            f.write('-'*len(path))
+            f.write('\n\n')
             for type in dictionary[path].keys():
-                rst_string += type
-                rst_string += '\n'
-                rst_string += '^'*len(type)
-                rst_string += '\n\n'
+                f.write(type)
+                f.write('\n')
+                f.write('^'*len(type))
+                f.write('\n\n')
                 for id in dictionary[path][type].keys():
-                    rst_string += 'Test ID {}'.format(id)
-                    rst_string += '\n'
-                    rst_string += '*'*len('Test ID {}'.format(id))
-                    rst_string += '\n\n'
+                    f.write('Test ID {}'.format(id))
+                    f.write('\n')
+                    f.write('*'*len('Test ID {}'.format(id)))
+                    f.write('\n\n')
                     for foo in dictionary[path][type][id].keys():
                         if isinstance(dictionary[path][type][id][foo], dict):
-                            rst_string += '-\t{}'.format(foo)
-                            rst_string += '\n\n'
+                            f.write('-\t{}'.format(foo))
+                            f.write('\n\n')
                             for bar in dictionary[path][type][id][foo].keys():
                                 value = dictionary[path][type][id][foo][bar]
-                                rst_string += '\t-\t{}:\t{}'.format(bar, value)
-                                rst_string += '\n'
+                                f.write('\t-\t{}:\t{}'.format(bar, value))
+                                f.write('\n')
                         else:
                             value = dictionary[path][type][id][foo]
-                            rst_string += '-\t{}:\t{}'.format(foo, value)
-                            rst_string += '\n'
-                    rst_string += '\n'
-        return(rst_string)
+                            f.write('-\t{}:\t{}'.format(foo, value))
+                            f.write('\n')
+                    f.write('\n')
+
+    def _write_title(self, f, title):
+        f.write(title)
+        f.write('\n')
+        f.write('='*len(title))
+        f.write('\n\n')
 
 
     def evaluate_(self, data, reference, method, df=1.):
@@ -509,12 +1087,12 @@ class HealthCheck:
             The standard deviation of all evaluations
         """
 
-        values=[]
-
-        for reference in listof_references:
-            value = self.evaluate_(
-                data=data, reference=reference, method=method, df=df)
-            values.append(value)
+        values = vishack.core.evaluate.evaluate_batch(
+            data=data, references=listof_references, methods=[method], df=df)
+        if method not in values:
+            logger.error('Method {} not available. Ignoring...'.format(method))
+            return(None, None)
+        values = values[method]
 
         mean = np.mean(values)
         std = np.std(values)
@@ -544,33 +1122,67 @@ class HealthCheck:
             The standard deviation of all evaluations
         """
 
-        values = []
-        for i in range(len(listof_references)):
-            for j in range(i+1, len(listof_references)):
-                value = self.evaluate_(
-                    data=listof_references[i],
-                    reference=listof_references[j],
-                    method=method, df=df)
-                values.append(value)
-
-        mean = np.mean(values)
-        std = np.std(values)
+        stats = vishack.core.evaluate.pairwise_evaluate(
+            references=listof_references, methods=[method], df=df)
+        if method not in stats:
+            logger.error('Method {} not available. Ignoring...'.format(method))
+            return(None, None)
+        mean, std = stats[method]
 
         return(mean, std)
 
-    def _try_read_diaggui(self, path):
-        try:
-            dtt2hdf.read_diaggui(path)
+    def _add_path(self, path, sniffed=False):
+        """Add a diaggui XML file to be checked.
+
+        Only the header of the file is read here. The file is parsed when it
+        is checked, so each file is parsed once per check.
+
+        Parameters
+        ----------
+        path: string
+            The path of the file.
+        sniffed: boolean, optional
+            The file is already known to look like a diaggui XML file, e.g.
+            found by :code:`vishack.data.diaggui.find_diaggui()`.
+            Defaults to False.
+        """
+        if path in self.paths:
+            # Duplicates are reported and removed later.
             self.paths.append(path)
-        except xml.etree.ElementTree.ParseError:
-            logger.warning(
-                '{} is not a diaggui XML file.'\
-                ' Ignoring...'.format(path))
-        except IsADirectoryError:
-            logger.warning('{} is a directory. Ignoring...'\
-                ''.format(path))
+            return
+        if not sniffed:
+            if os.path.isdir(path):
+                logger.warning('{} is a directory. Ignoring...'\
+                    ''.format(path))
+                return
+            if not os.path.exists(path):
+                logger.warning('{} not exist. Ignoring...'.format(path))
+                return
+            if not vishack.data.diaggui.is_diaggui(path):
+                logger.warning(
+                    '{} is not a diaggui XML file.'\
+                    ' Ignoring...'.format(path))
+                return
+        self.paths.append(path)
+
+    def _get_diaggui(self, path):
+        """Parse a diaggui XML file.
+
+        Returns None if the file can't be parsed.
+        """
+        try:
+            with self.timer.stage('parsing', path):
+                dg = vishack.data.diaggui.Diaggui(
+                    path, cache=self._disk_cache)
         except FileNotFoundError:
             logger.warning('{} not exist. Ignoring...'.format(path))
+            return(None)
+        except vishack.data.diaggui.parse_errors as e:
+            logger.warning(
+                '{} is not a diaggui XML file ({}: {}).'\
+                ' Ignoring...'.format(path, type(e).__name__, e))
+            return(None)
+        return(dg)
 
     def _remove_duplicated_paths(self):
         self.paths.reverse()
@@ -579,3 +1191,38 @@ class HealthCheck:
                 logger.warning('Duplicated path {} removed'.format(path))
                 self.paths.remove(path)
         self.paths.reverse()
+
+
+def _check_path_job(state, path, typelist, baseline_cache):
+    """Check a diaggui XML file in a worker process.
+
+    Parameters
+    ----------
+    state: dict
+        The attributes of the HealthCheck needed to check the file, from
+        :code:`HealthCheck._worker_state()`.
+    path: string
+        The path of the diaggui XML file.
+    typelist: list of string
+        The type of checks to be performed.
+    baseline_cache: vishack.core.baseline.BaselineCache
+        The baselines of the file only.
+
+    Returns
+    -------
+    report: dict
+        The report of the file, with the list of tests of each type.
+    baselines: dict
+        The baselines used for the file, which are otherwise lost with the
+        worker.
+    timings: dict
+        The timings of the stages of the file in the worker, from
+        :code:`vishack.core.timing.StageTimer.summary()`.
+    """
+
+    health_check = HealthCheck.__new__(HealthCheck)
+    health_check.__dict__.update(state)
+    health_check._baseline_cache = baseline_cache
+    health_check._workspace = vishack.core.evaluate.Workspace()
+    path_report = health_check._check_path(path, typelist)
+    return(path_report, baseline_cache.used, health_check.timer.summary())
@@ -0,0 +1,120 @@
+"""Persistent state of incremental health checks.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from vishack.logger import logger
+
+
+def hash_file(path, chunk_size=1<<20):
+    """Hash the content of a file.
+
+    Parameters
+    ----------
+    path: string
+        The path of the file.
+    chunk_size: int, optional
+        The number of bytes read at a time.
+        Defaults to 1 MiB.
+
+    Returns
+    -------
+    string
+        The SHA-1 hex digest of the file content.
+    """
+
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha1.update(chunk)
+    return(sha1.hexdigest())
+
+
+def hash_object(obj):
+    """Hash a JSON serializable object.
+
+    Parameters
+    ----------
+    obj: object
+        Any object that can be turned into JSON with :code:`to_builtin()`.
+
+    Returns
+    -------
+    string
+        The SHA-1 hex digest of the object.
+    """
+
+    string = json.dumps(to_builtin(obj), sort_keys=True)
+    return(hashlib.sha1(string.encode()).hexdigest())
+
+
+def to_builtin(obj):
+    """Turn NumPy types in nested dicts and lists to Python builtin types.
+
+    Parameters
+    ----------
+    obj: object
+        The object to be converted.
+
+    Returns
+    -------
+    object
+        The object with only builtin types, which can be written as JSON.
+    """
+
+    if isinstance(obj, dict):
+        return({key: to_builtin(value) for key, value in obj.items()})
+    elif isinstance(obj, (list, tuple)):
+        return([to_builtin(value) for value in obj])
+    elif isinstance(obj, np.ndarray):
+        return(obj.tolist())
+    elif isinstance(obj, np.generic):
+        return(obj.item())
+    else:
+        return(obj)
+
+
+def load_state(path):
+    """Load a state file.
+
+    Parameters
+    ----------
+    path: string
+        The path of the state file.
+
+    Returns
+    -------
+    dict
+        The state. Empty if the file doesn't exist or can't be read.
+    """
+
+    if not os.path.exists(path):
+        return({})
+    try:
+        with open(path, 'r') as f:
+            return(json.load(f))
+    except (OSError, ValueError) as e:
+        logger.warning('Cannot read state file {} ({}). '\
+            'Ignoring...'.format(path, e))
+        return({})
+
+
+def save_state(path, state):
+    """Write a state file, replacing the old one atomically.
+
+    Parameters
+    ----------
+    path: string
+        The path of the state file.
+    state: dict
+        The state to be saved.
+    """
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(to_builtin(state), f)
+    os.replace(tmp_path, path)
@@ -0,0 +1,254 @@
+"""Columnar table of health check results.
+"""
+
+import numpy as np
+
+numeric_columns = (
+    'Test ID',
+    'Reference mean',
+    'Reference standard deviation',
+    'Result (raw)',
+    'Result (sigma)',
+)
+method_columns = (
+    'Reference mean',
+    'Reference standard deviation',
+    'Result (raw)',
+    'Result (sigma)',
+)
+
+
+class ResultTable:
+    """Health check results with one row per test and method.
+
+    Each row is a (path, type, test ID, channel A, channel B, band, method)
+    combination with its reference mean, reference standard deviation,
+    raw result and result in sigma. Tests evaluated in a frequency band have
+    their own test ID. Columns are NumPy arrays so results
+    can be filtered and aggregated without walking nested dictionaries.
+
+    Attributes
+    ----------
+    columns: tuple of strings
+        The names of the columns.
+    """
+
+    columns = (
+        'Path',
+        'Type',
+        'Test ID',
+        'Channel A',
+        'Channel B',
+        'Band',
+        'Method',
+        'Reference mean',
+        'Reference standard deviation',
+        'Result (raw)',
+        'Result (sigma)',
+    )
+
+    def __init__(self):
+        """Initiate an empty ResultTable.
+        """
+
+        self._rows = {column: [] for column in self.columns}
+        self._references = []
+        self._path_rows = {}
+        self._sections = {}
+        self._arrays = {}
+
+    def __len__(self):
+        return(len(self._references))
+
+    def __getitem__(self, column):
+        """Return a column as a NumPy array.
+
+        Parameters
+        ----------
+        column: string
+            The name of the column.
+
+        Returns
+        -------
+        array
+            The column. Text columns have object dtype. Channel B is None
+            for tests without channel B, and Band is None for tests over
+            the full spectrum.
+        """
+
+        if column not in self._arrays.keys():
+            if column in numeric_columns:
+                dtype = float if column != 'Test ID' else int
+            else:
+                dtype = object
+            array = np.empty(len(self), dtype=dtype)
+            array[:] = self._rows[column]
+            self._arrays[column] = array
+        return(self._arrays[column])
+
+    def add_section(self, path, type=None):
+        """Register a file and a type of tests, even if it has no tests.
+
+        Registered sections appear in the report from :code:`to_report()`.
+
+        Parameters
+        ----------
+        path: string
+            The path of the diaggui XML file.
+        type: string, optional
+            The type of the tests, e.g. 'Transfer function'.
+            If None, only the file is registered.
+            Defaults to None.
+        """
+
+        types = self._sections.setdefault(path, [])
+        if type is not None and type not in types:
+            types.append(type)
+
+    def add_test(self, path, type, id, test):
+        """Add the rows of a test.
+
+        Parameters
+        ----------
+        path: string
+            The path of the diaggui XML file.
+        type: string
+            The type of the test, e.g. 'Transfer function'.
+        id: int
+            The test ID.
+        test: dict
+            The test in the report format, i.e. with keys 'References',
+            'Channel A', optionally 'Channel B' and 'Band', and the methods
+            with dictionaries of the results as values.
+        """
+
+        self._arrays = {}
+        start = len(self)
+        for method in test.keys():
+            if not isinstance(test[method], dict):
+                continue
+            self._rows['Path'].append(path)
+            self._rows['Type'].append(type)
+            self._rows['Test ID'].append(id)
+            self._rows['Channel A'].append(test['Channel A'])
+            self._rows['Channel B'].append(test.get('Channel B'))
+            self._rows['Band'].append(test.get('Band'))
+            self._rows['Method'].append(method)
+            for column in method_columns:
+                self._rows[column].append(test[method][column])
+            self._references.append(test['References'])
+        first, _ = self._path_rows.get(path, (start, start))
+        self._path_rows[path] = (first, len(self))
+
+    def select(self, mask):
+        """Return the rows selected by a mask or indices.
+
+        Parameters
+        ----------
+        mask: array
+            Boolean mask or integer indices of the rows.
+
+        Returns
+        -------
+        ResultTable
+            A new table with the selected rows.
+        """
+
+        indices = np.arange(len(self))[mask]
+        table = ResultTable()
+        for column in self.columns:
+            table._rows[column] = [self._rows[column][i] for i in indices]
+        table._references = [self._references[i] for i in indices]
+        for i, path in enumerate(table._rows['Path']):
+            first, _ = table._path_rows.get(path, (i, i))
+            table._path_rows[path] = (first, i+1)
+        return(table)
+
+    def alert_mask(self, threshold=3):
+        """Mask of the tests with any result beyond the threshold.
+
+        Parameters
+        ----------
+        threshold: float, optional
+            The threshold of the result in unit of sigma.
+            Defaults to 3.
+
+        Returns
+        -------
+        array
+            Boolean mask of all rows of the alerting tests, so each test is
+            either kept or dropped as a whole.
+        """
+
+        alerting = np.abs(self['Result (sigma)']) >= threshold
+        alerting_ids = np.unique(self['Test ID'][alerting])
+        return(np.isin(self['Test ID'], alerting_ids))
+
+    def to_report(self, path=None):
+        """Convert the table to the nested report dictionary.
+
+        Parameters
+        ----------
+        path: string, optional
+            Only convert the rows of this diaggui XML file.
+            If None, convert all rows.
+            Defaults to None.
+
+        Returns
+        -------
+        dict
+            The report with the levels path, type, test ID and method,
+            as in :code:`vishack.HealthCheck.report`. The values are the
+            ones added to the table, not converted to the column dtypes.
+        """
+
+        report = {}
+        for path_ in self._sections.keys():
+            if path is None or path_ == path:
+                report[path_] = {}
+                for type in self._sections[path_]:
+                    report[path_][type] = {}
+        if path is None:
+            rows = range(len(self))
+        elif path in self._path_rows.keys():
+            rows = range(*self._path_rows[path])
+        else:
+            rows = range(0)
+        for i in rows:
+            path_ = self._rows['Path'][i]
+            type = self._rows['Type'][i]
+            id = self._rows['Test ID'][i]
+            types = report.setdefault(path_, {})
+            tests = types.setdefault(type, {})
+            if id not in tests.keys():
+                test = {}
+                test['References'] = self._references[i]
+                test['Channel A'] = self._rows['Channel A'][i]
+                if self._rows['Channel B'][i] is not None:
+                    test['Channel B'] = self._rows['Channel B'][i]
+                if self._rows['Band'][i] is not None:
+                    test['Band'] = self._rows['Band'][i]
+                tests[id] = test
+            method = {}
+            for column in method_columns:
+                method[column] = self._rows[column][i]
+            tests[id][self._rows['Method'][i]] = method
+        return(report)
+
+    def to_pandas(self):
+        """Convert the table to a pandas DataFrame.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The table with one column per column name.
+
+        Note
+        ----
+        Requires pandas, which is not a dependency of VISHack.
+        """
+
+        import pandas
+
+        return(pandas.DataFrame(
+            {column: self[column] for column in self.columns}))
@@ -0,0 +1,317 @@
+"""Timing of the stages of a health check.
+"""
+
+import contextlib
+import cProfile
+import json
+import sys
+import threading
+import time
+import tracemalloc
+
+from vishack.logger import logger
+
+try:
+    import resource
+except ImportError:  # Not available on Windows.
+    resource = None
+
+
+class StageTimer:
+    """Record the wall time, count and peak memory of stages.
+
+    Stages are timed with :code:`stage()`. The totals are kept per stage
+    and per file, if the stage is timed for a file.
+
+    Parameters
+    ----------
+    trace_memory: boolean, optional
+        Record the peak memory allocated by Python in each stage with
+        tracemalloc, which is started when a stage is timed. This slows
+        down the stages.
+        Defaults to False.
+    sinks: list of functions, optional
+        Called as :code:`sink(name, path, elapsed, peak_memory)` after
+        each stage, with peak_memory being None if memory isn't traced.
+        See :code:`log_sink()`.
+        Defaults to None.
+
+    Attributes
+    ----------
+    trace_memory: boolean
+        Record the peak memory of each stage.
+    sinks: list of functions
+        Called after each stage.
+    stages: dict
+        The totals of each stage with the stage names as the keys.
+    files: dict
+        The totals of each stage of each file with the paths as the keys.
+    """
+
+    def __init__(self, trace_memory=False, sinks=None):
+        """Initiate StageTimer.
+
+        Parameters
+        ----------
+        trace_memory: boolean, optional
+            Record the peak memory allocated by Python in each stage with
+            tracemalloc.
+            Defaults to False.
+        sinks: list of functions, optional
+            Called as :code:`sink(name, path, elapsed, peak_memory)` after
+            each stage.
+            Defaults to None.
+        """
+
+        self.trace_memory = trace_memory
+        self.sinks = [] if sinks is None else list(sinks)
+        self.stages = {}
+        self.files = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __getstate__(self):
+        """Send an empty timer to worker processes.
+
+        The sinks stay in this process. The totals of the worker are
+        returned with :code:`summary()` and added with :code:`merge()`.
+        """
+        return({'trace_memory': self.trace_memory})
+
+    def __setstate__(self, state):
+        self.__init__(trace_memory=state['trace_memory'])
+
+    @contextlib.contextmanager
+    def stage(self, name, path=None):
+        """Time a stage.
+
+        Parameters
+        ----------
+        name: string
+            The name of the stage.
+        path: string, optional
+            The file the stage is run for.
+            Defaults to None.
+
+        Example
+        -------
+        >>> with timer.stage('parsing', path):
+        ...     dg = vishack.data.diaggui.Diaggui(path)
+        """
+
+        memory = self._enter_memory() if self.trace_memory else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            peak_memory = None
+            if memory is not None:
+                peak_memory = self._exit_memory(memory)
+            self.record(name, elapsed, path=path, peak_memory=peak_memory)
+
+    def iterate(self, name, iterable):
+        """Iterate over an iterable, timing each step as a stage.
+
+        Parameters
+        ----------
+        name: string
+            The name of the stage.
+        iterable: iterable
+            E.g. a generator that does the work of the stage lazily.
+
+        Yields
+        ------
+        The items of the iterable.
+        """
+
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield(item)
+
+    def record(self, name, elapsed, path=None, count=1, peak_memory=None):
+        """Add to the totals of a stage.
+
+        Parameters
+        ----------
+        name: string
+            The name of the stage.
+        elapsed: float
+            The wall time (s) spent in the stage.
+        path: string, optional
+            The file the stage is run for.
+            Defaults to None.
+        count: int, optional
+            The number of times the stage is run.
+            Defaults to 1.
+        peak_memory: int, optional
+            The peak memory (bytes) allocated in the stage.
+            Defaults to None.
+        """
+
+        totals = {
+            'Time (s)': elapsed,
+            'Count': count,
+            'Peak memory (B)': peak_memory,
+        }
+        with self._lock:
+            _add(self.stages, name, totals)
+            if path is not None:
+                _add(self.files.setdefault(path, {}), name, totals)
+        for sink in self.sinks:
+            sink(name, path, elapsed, peak_memory)
+
+    def merge(self, summary):
+        """Add the totals of another timer, e.g. in a worker process.
+
+        Parameters
+        ----------
+        summary: dict
+            The return of :code:`summary()` of the other timer.
+        """
+
+        with self._lock:
+            for name, totals in summary['Stages'].items():
+                _add(self.stages, name, totals)
+            for path, stages in summary['Files'].items():
+                for name, totals in stages.items():
+                    _add(self.files.setdefault(path, {}), name, totals)
+
+    def reset(self):
+        """Remove all totals."""
+        with self._lock:
+            self.stages = {}
+            self.files = {}
+
+    def summary(self):
+        """Return the totals.
+
+        Returns
+        -------
+        dict
+            The totals of each stage under "Stages" and of each stage of
+            each file under "Files". Each total is a dict with keys
+            "Time (s)", "Count" and "Peak memory (B)", which is None if
+            memory isn't traced.
+        """
+
+        with self._lock:
+            return({
+                'Stages': {name: dict(totals)
+                    for name, totals in self.stages.items()},
+                'Files': {path: {name: dict(totals)
+                    for name, totals in stages.items()}
+                    for path, stages in self.files.items()},
+            })
+
+    def _enter_memory(self):
+        """Start tracing memory for a stage, which may be nested."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        memory = {'start': current, 'peak': current}
+        stack.append(memory)
+        return(memory)
+
+    def _exit_memory(self, memory):
+        """Return the peak memory (bytes) allocated in a stage."""
+        # Stages are nested in each thread, so this is the last one.
+        stack = self._local.stack
+        stack.pop()
+        if not tracemalloc.is_tracing():
+            return(None)
+        peak = max(memory['peak'], tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1]['peak'] = max(stack[-1]['peak'], peak)
+        return(peak - memory['start'])
+
+
+def _add(totals, name, new):
+    """Add the totals of a stage to a dict of totals."""
+    if name not in totals:
+        totals[name] = dict(new)
+        return
+    total = totals[name]
+    total['Time (s)'] += new['Time (s)']
+    total['Count'] += new['Count']
+    if new['Peak memory (B)'] is not None:
+        if total['Peak memory (B)'] is None:
+            total['Peak memory (B)'] = new['Peak memory (B)']
+        else:
+            total['Peak memory (B)'] = max(
+                total['Peak memory (B)'], new['Peak memory (B)'])
+
+
+def log_sink(name, path, elapsed, peak_memory):
+    """A StageTimer sink that logs each stage at debug level."""
+    message = '{} took {:.3g} s'.format(name, elapsed)
+    if path is not None:
+        message += ' for {}'.format(path)
+    if peak_memory is not None:
+        message += ', peak memory {} B'.format(peak_memory)
+    logger.debug(message+'.')
+
+
+def max_rss():
+    """Return the maximum resident set size (bytes) of this process.
+
+    Returns
+    -------
+    int
+        The maximum resident set size, or None if not available.
+    """
+
+    if resource is None:
+        return(None)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere.
+    if sys.platform != 'darwin':
+        rss *= 1024
+    return(rss)
+
+
+def write_json(timings, path):
+    """Write timings to a JSON file.
+
+    Parameters
+    ----------
+    timings: dict
+        E.g. :code:`HealthCheck.timings`.
+    path: string
+        The path of the JSON file.
+    """
+
+    with open(path, 'w') as f:
+        json.dump(timings, f, indent=2)
+
+
+@contextlib.contextmanager
+def profile(path):
+    """Profile the code in the context with cProfile.
+
+    Parameters
+    ----------
+    path: string
+        The path where the profile is written. Read it with
+        :code:`pstats.Stats(path)`.
+    """
+
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield(profiler)
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
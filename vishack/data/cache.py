@@ -0,0 +1,266 @@
+"""On-disk cache of parsed diaggui XML files.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from declarative.bunch import Bunch, DeepBunch
+
+from vishack.logger import logger
+
+cache_format_version = 1
+default_size_limit = 1024  # MB
+index_name = 'index.json'
+
+
+class DiagguiCache:
+    """Content-addressed cache of :code:`dtt2hdf.read_diaggui()` outputs.
+
+    Each entry is a directory named by the hash of the absolute path, the
+    modification time and the size of the diaggui XML file. Arrays are
+    stored as .npy files and are memory mapped when loaded. Everything else
+    is stored in a small JSON index.
+
+    Parameters
+    ----------
+    directory: string
+        The cache directory. Created if it doesn't exist.
+    size_limit: float, optional
+        The maximum size of the cache in MB. The least recently used entries
+        are evicted when the cache grows beyond this size.
+        Defaults to 1024.
+
+    Attributes
+    ----------
+    directory: string
+        The cache directory.
+    size_limit: float
+        The maximum size of the cache in MB.
+    """
+
+    def __init__(self, directory, size_limit=default_size_limit):
+        """Initiate DiagguiCache with a cache directory.
+
+        Parameters
+        ----------
+        directory: string
+            The cache directory. Created if it doesn't exist.
+        size_limit: float, optional
+            The maximum size of the cache in MB.
+            Defaults to 1024.
+        """
+
+        self.directory = directory
+        self.size_limit = size_limit
+        os.makedirs(self.directory, exist_ok=True)
+        # The size of each entry in bytes, by entry name. Found on the first
+        # eviction and kept up to date by store() and evict(), so the
+        # entries are not scanned each time a file is stored.
+        self._sizes = None
+
+    def key(self, path):
+        """Return the cache key of a diaggui XML file.
+
+        Parameters
+        ----------
+        path: string
+            The path of the diaggui XML file.
+
+        Returns
+        -------
+        string
+            The hex digest identifying the current content of the file.
+        """
+
+        stat = os.stat(path)
+        identity = '{}\n{}\n{}\n{}'.format(
+            cache_format_version, os.path.abspath(path),
+            stat.st_mtime_ns, stat.st_size)
+        return(hashlib.sha1(identity.encode()).hexdigest())
+
+    def load(self, path):
+        """Load the parsed diaggui XML file from the cache.
+
+        Parameters
+        ----------
+        path: string
+            The path of the diaggui XML file.
+
+        Returns
+        -------
+        declarative.bunch.bunch.Bunch or None
+            The cached :code:`dtt2hdf.read_diaggui(path)` output.
+            None if the file is not cached.
+        """
+
+        entry = os.path.join(self.directory, self.key(path))
+        index_path = os.path.join(entry, index_name)
+        try:
+            with open(index_path, 'r') as f:
+                index = json.load(f)
+            items = _decode(index, entry)
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(entry):
+                logger.warning('Corrupted cache entry for {} ({}). '\
+                    'Ignoring...'.format(path, e))
+            return(None)
+        try:
+            os.utime(index_path)  # Marks the entry as recently used.
+        except OSError:
+            pass
+        return(items)
+
+    def store(self, path, items):
+        """Store a parsed diaggui XML file in the cache.
+
+        Parameters
+        ----------
+        path: string
+            The path of the diaggui XML file.
+        items: declarative.bunch.bunch.Bunch
+            The output from :code:`dtt2hdf.read_diaggui(path)`.
+        """
+
+        name = self.key(path)
+        entry = os.path.join(self.directory, name)
+        if os.path.exists(entry):
+            return
+        tmp = tempfile.mkdtemp(prefix='.tmp', dir=self.directory)
+        try:
+            arrays = []
+            index = _encode(items, arrays)
+            for i, array in enumerate(arrays):
+                np.save(os.path.join(tmp, '{}.npy'.format(i)), array)
+            with open(os.path.join(tmp, index_name), 'w') as f:
+                json.dump(index, f)
+            size = _directory_size(tmp)
+            os.rename(tmp, entry)
+            if self._sizes is not None:
+                self._sizes[name] = size
+        except OSError as e:
+            logger.warning('Cannot cache {} ({}).'.format(path, e))
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries until within size limit.
+
+        Entries that can't be read or removed, e.g. by another process, are
+        skipped.
+        """
+
+        if self._sizes is None:
+            self._sizes = self._scan_sizes()
+        total = sum(self._sizes.values())
+        if total <= self.size_limit*1e6:
+            return
+        entries = []
+        for name, size in self._sizes.items():
+            try:
+                last_used = os.stat(
+                    os.path.join(self.directory, name, index_name)).st_mtime
+            except OSError:
+                last_used = 0
+            entries.append((last_used, size, name))
+        entries.sort()
+        for _, size, name in entries:
+            if total <= self.size_limit*1e6:
+                break
+            shutil.rmtree(
+                os.path.join(self.directory, name), ignore_errors=True)
+            del self._sizes[name]
+            total -= size
+
+    def _scan_sizes(self):
+        """Return the size of each entry in the cache directory."""
+        sizes = {}
+        try:
+            dir_entries = list(os.scandir(self.directory))
+        except OSError as e:
+            logger.warning('Cannot read cache {} ({}).'\
+                ''.format(self.directory, e))
+            return(sizes)
+        for dir_entry in dir_entries:
+            try:
+                if not dir_entry.is_dir() or dir_entry.name.startswith('.'):
+                    continue
+                sizes[dir_entry.name] = _directory_size(dir_entry.path)
+            except OSError:
+                continue
+        return(sizes)
+
+    def clear(self):
+        """Remove all entries in the cache.
+        """
+
+        logger.info('Clearing diaggui cache {}.'.format(self.directory))
+        for dir_entry in os.scandir(self.directory):
+            if dir_entry.is_dir():
+                shutil.rmtree(dir_entry.path, ignore_errors=True)
+        self._sizes = None
+
+
+def _directory_size(directory):
+    """Return the total size of the files in a directory in bytes."""
+    size = 0
+    for file_entry in os.scandir(directory):
+        size += file_entry.stat().st_size
+    return(size)
+
+
+def _encode(item, arrays):
+    """Turn a parsed diaggui item to JSON-able objects, collecting arrays.
+    """
+
+    if isinstance(item, np.ndarray):
+        arrays.append(item)
+        return({'array': '{}.npy'.format(len(arrays)-1)})
+    elif hasattr(item, 'items'):
+        if isinstance(item, DeepBunch):
+            kind = 'deepbunch'
+        elif isinstance(item, Bunch):
+            kind = 'bunch'
+        else:
+            kind = 'dict'
+        pairs = []
+        for key, value in item.items():
+            if isinstance(key, np.generic):
+                key = key.item()
+            pairs.append([key, _encode(value, arrays)])
+        return({kind: pairs})
+    elif isinstance(item, np.generic):
+        return({'value': item.item()})
+    else:
+        return({'value': item})
+
+
+def _decode(node, entry, deep=False):
+    """Rebuild a parsed diaggui item from the JSON index of a cache entry.
+    """
+
+    if 'array' in node:
+        return(np.load(os.path.join(entry, node['array']), mmap_mode='r'))
+    elif 'value' in node:
+        return(node['value'])
+    kind, = node.keys()
+    is_deep = kind == 'deepbunch'
+    mapping = {}
+    for key, value in node[kind]:
+        mapping[key] = _decode(value, entry, deep=is_deep)
+    if kind == 'bunch':
+        return(Bunch(mapping))
+    elif is_deep and not deep:
+        # Filled item by item, like dtt2hdf does, to get a writable DeepBunch.
+        bunch = DeepBunch()
+        for key, value in mapping.items():
+            bunch[key] = value
+        return(bunch)
+    else:
+        # Nested DeepBunch are stored as plain dicts by their parents.
+        return(mapping)
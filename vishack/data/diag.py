@@ -1,10 +1,24 @@
 """Library for interfacing with the diagnostic tools command `diag`.
 """
 
+import asyncio
 import os, stat
+import shlex
+import subprocess
+import tempfile
+import threading
+
 import vishack.data.output
+from vishack.logger import logger
 
 bash_header = '# !/bin/bash\n'
+default_command = 'diag'
+
+
+class MeasurementError(RuntimeError):
+    """A diag measurement failed, timed out or was cancelled.
+    """
+
 
 def make_script(path, lines, overwrite=False):
     """Create a script and make it executable
@@ -29,8 +43,8 @@ def make_script(path, lines, overwrite=False):
             f.write(line)
             f.write('\n')
 
-def run_measurement(path, saveas=None, remove_tmp=True):
-    """Run a measurement set up by a diaggui XML file.
+def measurement_lines(path, saveas=None):
+    """Return the diag commands that run a measurement.
 
     Parameters
     ----------
@@ -39,13 +53,12 @@ def run_measurement(path, saveas=None, remove_tmp=True):
     saveas: string, optional
         Save the measurement as a different file when finished measurement.
         Defaults to None. If None, it is same as `path`
-    remove_tmp: boolean, optional
-        Remove any temporary files that are used to trigger this measurement.
-        Defaults to True.
-    """
 
-    if not os.path.exists(path):
-        raise FileNotFoundError('{} not exists'.format(path))
+    Returns
+    -------
+    list of strings
+        The script lines.
+    """
 
     if saveas is None:
         saveas = path
@@ -58,11 +71,245 @@ def run_measurement(path, saveas=None, remove_tmp=True):
         'save {}'.format(saveas),
         'quit',
     ]
+    return(lines)
+
+def _write_script(path, saveas):
+    """Write the diag script of a measurement to a unique temporary file.
+    """
+
+    fd, script_path = tempfile.mkstemp(prefix='vishack_diag_', suffix='.txt')
+    with os.fdopen(fd, 'w') as f:
+        for line in measurement_lines(path=path, saveas=saveas):
+            f.write(line)
+            f.write('\n')
+    return(script_path)
+
+def run_measurement(path, saveas=None, remove_tmp=True,
+        command=default_command, timeout=None):
+    """Run a measurement set up by a diaggui XML file.
+
+    Parameters
+    ----------
+    path: string
+        The path of the diaggui XML file
+    saveas: string, optional
+        Save the measurement as a different file when finished measurement.
+        Defaults to None. If None, it is same as `path`
+    remove_tmp: boolean, optional
+        Remove any temporary files that are used to trigger this measurement.
+        Defaults to True.
+    command: string, optional
+        The diag executable, optionally with arguments.
+        Defaults to 'diag'.
+    timeout: float, optional
+        The time in seconds after which the measurement is killed.
+        If None, wait until the measurement finishes.
+        Defaults to None.
+
+    Raises
+    ------
+    MeasurementError
+        If diag returns a non-zero code or the measurement timed out.
+    """
+
+    if not os.path.exists(path):
+        raise FileNotFoundError('{} not exists'.format(path))
+
+    script_path = _write_script(path=path, saveas=saveas)
+    try:
+        returncode = subprocess.call(
+            shlex.split(command) + ['-f', script_path], timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise MeasurementError('Measurement of {} timed out after {} s.'\
+            ''.format(path, timeout))
+    finally:
+        if remove_tmp:
+            os.remove(script_path)
+    if returncode != 0:
+        raise MeasurementError('Measurement of {} failed with return code '\
+            '{}.'.format(path, returncode))
+
+
+class MeasurementScheduler:
+    """Run diaggui measurements concurrently.
+
+    Each measurement is a `diag` subprocess. At most
+    :code:`max_concurrent` of them run at the same time.
+
+    Parameters
+    ----------
+    max_concurrent: int, optional
+        The maximum number of measurements running at the same time.
+        Defaults to 1.
+    timeout: float, optional
+        The time in seconds after which a measurement is killed.
+        If None, wait until the measurement finishes.
+        Defaults to None.
+    command: string, optional
+        The diag executable, optionally with arguments.
+        Defaults to 'diag'.
+    remove_tmp: boolean, optional
+        Remove the temporary diag scripts.
+        Defaults to True.
+
+    Attributes
+    ----------
+    max_concurrent: int
+        The maximum number of measurements running at the same time.
+    timeout: float
+        The time in seconds after which a measurement is killed.
+    command: string
+        The diag executable, optionally with arguments.
+    remove_tmp: boolean
+        Remove the temporary diag scripts.
+    """
+
+    def __init__(self, max_concurrent=1, timeout=None,
+            command=default_command, remove_tmp=True):
+        """Initiate MeasurementScheduler.
+
+        Parameters
+        ----------
+        max_concurrent: int, optional
+            The maximum number of measurements running at the same time.
+            Defaults to 1.
+        timeout: float, optional
+            The time in seconds after which a measurement is killed.
+            If None, wait until the measurement finishes.
+            Defaults to None.
+        command: string, optional
+            The diag executable, optionally with arguments.
+            Defaults to 'diag'.
+        remove_tmp: boolean, optional
+            Remove the temporary diag scripts.
+            Defaults to True.
+        """
+
+        if max_concurrent < 1:
+            raise ValueError('max_concurrent must be at least 1.')
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self.command = command
+        self.remove_tmp = remove_tmp
+        self._loop = None
+        self._tasks = []
+        self._cancelled = False
+        self._lock = threading.Lock()
+
+    def run(self, paths, callback=None):
+        """Measure the diaggui XML files and wait until all are done.
+
+        Parameters
+        ----------
+        paths: list of strings
+            The paths of the diaggui XML files.
+        callback: function, optional
+            Called as :code:`callback(path, error)` in the calling thread
+            as soon as each measurement finishes, with error being None or
+            the MeasurementError. Defaults to None.
+
+        Returns
+        -------
+        dict
+            The MeasurementError of each path that failed, timed out or was
+            cancelled. Empty if all measurements succeeded.
+        """
+
+        errors = {}
+        if len(paths) == 0:
+            return(errors)
+        loop = asyncio.new_event_loop()
+        with self._lock:
+            self._loop = loop
+        try:
+            main = loop.create_task(self._run_all(paths, callback, errors))
+            try:
+                loop.run_until_complete(main)
+            except KeyboardInterrupt:
+                # Kill the running measurements before giving up.
+                main.cancel()
+                loop.run_until_complete(
+                    asyncio.gather(main, return_exceptions=True))
+                raise
+        finally:
+            with self._lock:
+                self._loop = None
+                self._tasks = []
+            loop.close()
+        return(errors)
+
+    def cancel(self):
+        """Cancel the measurements, e.g. from another thread.
+
+        Running measurements are killed and pending ones are not started.
+        A cancelled scheduler doesn't start any new measurements.
+        """
+
+        with self._lock:
+            self._cancelled = True
+            if self._loop is None:
+                return
+            for task in self._tasks:
+                self._loop.call_soon_threadsafe(task.cancel)
 
-    script_path = vishack.data.output.rename('tmp', method='utc')
-    make_script(path=script_path, lines=lines, overwrite=False)
+    async def _run_all(self, paths, callback, errors):
+        """Run the measurements with a limit on the concurrency."""
+        semaphore = asyncio.Semaphore(self.max_concurrent)
+        tasks = []
+        with self._lock:
+            for path in paths:
+                task = asyncio.ensure_future(self._measure(path, semaphore))
+                task.add_done_callback(
+                    lambda task, path=path: self._done(
+                        path, task, callback, errors))
+                tasks.append(task)
+            self._tasks = tasks
+        await asyncio.gather(*tasks, return_exceptions=True)
 
-    os.system('diag -f {}'.format(script_path))
+    def _done(self, path, task, callback, errors):
+        """Record the outcome of a measurement and pass it to the callback."""
+        if task.cancelled():
+            error = MeasurementError('Measurement of {} cancelled.'\
+                ''.format(path))
+        else:
+            error = task.exception()
+            if error is not None and not isinstance(error, MeasurementError):
+                error = MeasurementError('Measurement of {} failed ({}).'\
+                    ''.format(path, error))
+        if error is None:
+            logger.info('Measured {}.'.format(path))
+        else:
+            logger.error(str(error))
+            errors[path] = error
+        if callback is not None:
+            callback(path, error)
 
-    if remove_tmp:
-        os.remove(script_path)
+    async def _measure(self, path, semaphore):
+        """Run one measurement once a slot is free."""
+        async with semaphore:
+            if self._cancelled:
+                raise asyncio.CancelledError()
+            if not os.path.exists(path):
+                raise FileNotFoundError('{} not exists'.format(path))
+            logger.info('Measuring {}...'.format(path))
+            script_path = _write_script(path=path, saveas=None)
+            process = None
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *shlex.split(self.command), '-f', script_path,
+                    stdout=asyncio.subprocess.DEVNULL)
+                try:
+                    returncode = await asyncio.wait_for(
+                        process.wait(), timeout=self.timeout)
+                except asyncio.TimeoutError:
+                    raise MeasurementError('Measurement of {} timed out '\
+                        'after {} s.'.format(path, self.timeout))
+                if returncode != 0:
+                    raise MeasurementError('Measurement of {} failed with '\
+                        'return code {}.'.format(path, returncode))
+            finally:
+                if process is not None and process.returncode is None:
+                    process.kill()
+                    await process.wait()
+                if self.remove_tmp:
+                    os.remove(script_path)
@@ -1,12 +1,187 @@
 """A dtt2hdf wrapper for extracting data from diaggui XML output files
 """
 
+import concurrent.futures
 import dtt2hdf
+import dtt2hdf.parse_spectrum
+import dtt2hdf.parse_transfer
+import fnmatch
+import numpy as np
 import os
+import re
+import xml.etree.ElementTree
 import vishack.data.diag
 
+from declarative.bunch import Bunch
+
 from vishack.logger import logger
 
+sniff_size = 4096
+diaggui_signature = b'LIGO_LW'
+# The exceptions raised by dtt2hdf.read_diaggui() on files that are not
+# valid diaggui XML files.
+parse_errors = (
+    xml.etree.ElementTree.ParseError,
+    AttributeError,
+    IndexError,
+    KeyError,
+    TypeError,
+    ValueError,
+)
+reference_keys = ('xfer', 'response', 'PSD', 'CSD', 'coherence', 'FFT')
+# The type name and the data key of each node type and subtype,
+# as in dtt2hdf.
+node_keys = {
+    'Spectrum': {
+        0: ('FFT', 'FFT'),
+        1: ('PSD', 'PSD'),
+        2: ('CSD', 'CSD'),
+        3: ('COH', 'coherence'),
+        4: ('FFT', 'FFT'),
+        5: ('PSD', 'PSD'),
+        6: ('CSD', 'CSD'),
+        7: ('COH', 'coherence'),
+    },
+    'TransferFunction': {
+        0: ('TF', 'xfer'),
+        1: ('STF', 'response'),
+        2: ('COH', 'coherence'),
+        3: ('TF', 'xfer'),
+        4: ('STF', 'response'),
+        5: ('COH', 'coherence'),
+    },
+}
+node_parsers = {
+    'Spectrum': dtt2hdf.parse_spectrum.parse_spectrum,
+    'TransferFunction': dtt2hdf.parse_transfer.parse_transfer,
+}
+node_name_pattern = re.compile(r'(Result|Reference)\[(\d+)\]')
+
+
+def is_diaggui(path, size=sniff_size):
+    """Tell if a file looks like a diaggui XML file by reading its header.
+
+    Parameters
+    ----------
+    path: string
+        The path of the file.
+    size: int, optional
+        The number of bytes to read from the beginning of the file.
+        Defaults to 4096.
+
+    Returns
+    -------
+    boolean
+        True if the LIGO_LW signature is found in the header.
+
+    Note
+    ----
+    This is a cheap test. Files that pass it can still fail to be parsed,
+    with one of :code:`parse_errors`.
+    """
+
+    try:
+        with open(path, 'rb') as f:
+            header = f.read(size)
+    except OSError:
+        return(False)
+    return(diaggui_signature in header)
+
+
+def find_diaggui(directories, include_subfolders=False, include=None,
+        exclude=None, threads=1):
+    """Find diaggui XML files in directories.
+
+    Parameters
+    ----------
+    directories: list of strings
+        The directories to be searched.
+    include_subfolders: boolean, optional
+        Search the subfolders, subsubfolders, etc., as well.
+        Defaults to False.
+    include: list of strings, optional
+        Glob patterns. Only the files with names matching any of them are
+        considered. If None, all files are considered.
+        Defaults to None.
+    exclude: list of strings, optional
+        Glob patterns. The files with names matching any of them are ignored.
+        Defaults to None.
+    threads: int, optional
+        The number of threads used to read the file headers.
+        Defaults to 1.
+
+    Returns
+    -------
+    list of strings
+        The paths of the files that look like diaggui XML files.
+    """
+
+    candidates = []
+    for directory in directories:
+        candidates += _scan(
+            directory, include_subfolders=include_subfolders,
+            include=include, exclude=exclude)
+
+    if threads is not None and threads > 1:
+        with concurrent.futures.ThreadPoolExecutor(
+                max_workers=threads) as executor:
+            flags = list(executor.map(is_diaggui, candidates))
+    else:
+        flags = [is_diaggui(path) for path in candidates]
+
+    paths = []
+    for path, flag in zip(candidates, flags):
+        if flag:
+            paths.append(path)
+        else:
+            logger.warning(
+                '{} is not a diaggui XML file.'\
+                ' Ignoring...'.format(path))
+    return(paths)
+
+
+def _scan(directory, include_subfolders, include, exclude):
+    """List the files matching the patterns in a directory, like os.walk.
+
+    As with os.walk, symbolic links to directories are not followed and
+    directories that can't be read are skipped.
+    """
+    files = []
+    subfolders = []
+    try:
+        # Listed at once so that the directory is closed right away.
+        dir_entries = list(os.scandir(directory))
+    except OSError as e:
+        logger.warning('Cannot read {}: {}. Ignoring...'.format(directory, e))
+        dir_entries = []
+    for dir_entry in dir_entries:
+        try:
+            is_dir = dir_entry.is_dir()
+        except OSError:
+            is_dir = False
+        if is_dir:
+            if not dir_entry.is_symlink():
+                subfolders.append(dir_entry.path)
+        elif _match(dir_entry.name, include, exclude):
+            files.append(dir_entry.path)
+    if include_subfolders:
+        for subfolder in subfolders:
+            files += _scan(
+                subfolder, include_subfolders=include_subfolders,
+                include=include, exclude=exclude)
+    return(files)
+
+
+def _match(name, include, exclude):
+    """Match a file name against include and exclude glob patterns."""
+    if include and not any(
+            fnmatch.fnmatch(name, pattern) for pattern in include):
+        return(False)
+    if exclude and any(
+            fnmatch.fnmatch(name, pattern) for pattern in exclude):
+        return(False)
+    return(True)
+
 
 class Diaggui:
     """Diaggui class for handling and converting diaggui XML file.
@@ -15,31 +190,73 @@ class Diaggui:
     ----------
     path: string
         The path to the diaggui XML output file.
+    cache: vishack.data.cache.DiagguiCache, optional
+        The on-disk cache of parsed diaggui XML files.
+        If None, the file is always parsed.
+        Defaults to None.
 
     Attributes
     ----------
+    cache: vishack.data.cache.DiagguiCache
+        The on-disk cache of parsed diaggui XML files.
     items: declarative.bunch.bunch.Bunch
         The output from :code:`dtt2hdf.read_diaggui(path)`.
     path: string
         The path to the diaggui XML output file.
+    reference_index: dict
+        The indices of the references, with keys
+        (reference key, channel A, channel B). Channel B is None for the
+        references of any channel B.
     """
 
-    def __init__(self, path):
+    def __init__(self, path, cache=None):
         """Initial Diaggui class with a diaggui XML file
 
         Parameters
         ----------
         path: string
             The path to the diaggui XML output file.
+        cache: vishack.data.cache.DiagguiCache, optional
+            The on-disk cache of parsed diaggui XML files.
+            If None, the file is always parsed.
+            Defaults to None.
         """
 
+        self.cache = cache
         if not os.path.exists(path):
             self.items = None
             raise FileNotFoundError(
                 "Path {} doesn't exist.".format(path))
         else:
-            self.items = dtt2hdf.read_diaggui(path)
             self.path = path
+            self.items = self._read()
+            self._index_references()
+
+    def _read(self):
+        """Read the diaggui XML file, from the cache if possible."""
+        if self.cache is None:
+            return(dtt2hdf.read_diaggui(self.path))
+        items = self.cache.load(self.path)
+        if items is None:
+            items = dtt2hdf.read_diaggui(self.path)
+            self.cache.store(self.path, items)
+        return(items)
+
+    def _index_references(self):
+        """Index the references by reference key and channels."""
+        self.reference_index = {}
+        for index, reference in self.items.references.items():
+            if 'channelB' in reference:
+                channel_bs = list(reference['channelB'])
+            else:
+                channel_bs = []
+            for key in reference_keys:
+                if key not in reference:
+                    continue
+                channel_a = reference['channelA']
+                for channel_b in [None] + channel_bs:
+                    self.reference_index.setdefault(
+                        (key, channel_a, channel_b), []).append(index)
 
     def __str__(self):
         """ Return some useful info.
@@ -55,7 +272,7 @@ class Diaggui:
                 base = base[key]
         return True
 
-    def tf(self, channel_a, channel_b, datatype='results'):
+    def tf(self, channel_a, channel_b, datatype='results', out=None):
         """ Derive transfer function from CSD and PSD from diaggui file.
 
         Parameters
@@ -64,6 +281,11 @@ class Diaggui:
             The input channel string.
         channel_b: string
             The output channel string.
+        out: array, optional
+            The array where the transfer function is written, e.g. a reused
+            complex64 buffer. The squared PSD is computed in it as well, so
+            nothing else is allocated. If None, a new array is returned.
+            Defaults to None.
 
         Returns
         -------
@@ -71,11 +293,16 @@ class Diaggui:
             The frequency axis of the transfer function.
         tfdata: array
             The transfer function, defined by B/A, in complex numbers.
+            In the precision of the CSD, i.e. complex64 for diaggui data.
         """
 
         f, csddata = self.csd(channel_a=channel_a, channel_b=channel_b)
         _, psda = self.psd(channel_a)
-        tfdata = csddata/psda**2
+        if out is None:
+            tfdata = np.divide(csddata, np.square(psda))
+        else:
+            np.square(psda, out=out)
+            tfdata = np.divide(csddata, out, out=out)
 
         return(f, tfdata)
 
@@ -220,6 +447,47 @@ class Diaggui:
 
         return(dict(self.items.references[index]))
 
+    def find_references(self, reference_key, channel_a, channel_b=None):
+        """Find the references of a type and channels.
+
+        Parameters
+        ----------
+        reference_key: string
+            The key of the reference data, e.g. 'xfer', 'PSD', 'coherence'.
+        channel_a: string
+            The channel A of the references.
+        channel_b: string, optional
+            The channel B of the references. If None, references of any
+            channel B are returned.
+            Defaults to None.
+
+        Returns
+        -------
+        list of int
+            The indices of the matching references, in ascending order.
+        """
+
+        return(list(self.reference_index.get(
+            (reference_key, channel_a, channel_b), [])))
+
+    def get_reference_data(self, index, reference_key):
+        """Read the data of a reference plot without copying.
+
+        Parameters
+        ----------
+        index: int
+            The index of the reference plot in the diaggui XML
+        reference_key: string
+            The key of the reference data, e.g. 'xfer', 'PSD', 'coherence'.
+
+        Returns
+        -------
+        array
+            A view of the reference data.
+        """
+
+        return(self.items.references[index][reference_key][0])
+
     def get_results(self, type_name):
         """Return the results of a particular type from the diaggui XML file.
 
@@ -246,12 +514,226 @@ class Diaggui:
             raise ValueError('The file {} does not contain {} results.'\
                 ''.format(self.path, type_name))
 
-    def measure(self):
+    def measure(self, command=vishack.data.diag.default_command,
+            timeout=None):
         """Measure new results using the diaggui XML file.
+
+        Parameters
+        ----------
+        command: string, optional
+            The diag executable.
+            Defaults to 'diag'.
+        timeout: float, optional
+            The time in seconds after which the measurement is killed.
+            If None, wait until the measurement finishes.
+            Defaults to None.
         """
         vishack.data.diag.run_measurement(
             path=self.path,
             saveas=None,
-            remove_tmp=True
+            remove_tmp=True,
+            command=command,
+            timeout=timeout,
         )
-        self.items = dtt2hdf.read_diaggui(self.path)
+        self.items = self._read()
+        self._index_references()
+
+
+class StreamingDiaggui(Diaggui):
+    """Diaggui class that decodes only the requested data of a file.
+
+    The file is parsed incrementally and each result and reference is
+    discarded once it is read, so the memory used while parsing is bounded
+    by the largest result or reference rather than the file size. Only the
+    selected results and references are decoded. The other references are
+    indexed so that :code:`find_references()` still finds them.
+
+    Parameters
+    ----------
+    path: string
+        The path to the diaggui XML output file.
+    types: list of strings, optional
+        The type names of the results to be decoded, e.g. 'PSD', 'CSD',
+        'COH'. Transfer functions need 'CSD' and 'PSD'.
+        If None, all types are decoded.
+        Defaults to None.
+    channels: list of strings, optional
+        The results and references with channel A or any channel B in
+        channels are decoded. Transfer functions and coherence need both
+        channels.
+        If None, all channels are decoded.
+        Defaults to None.
+    references: list of int, optional
+        The indices of the references to be decoded, regardless of
+        channels. If None, the references are selected by channels.
+        Defaults to None.
+
+    Attributes
+    ----------
+    items: declarative.bunch.bunch.Bunch
+        The decoded results and references, in the same format as
+        :code:`dtt2hdf.read_diaggui(path)`.
+    path: string
+        The path to the diaggui XML output file.
+    reference_index: dict
+        The indices of all references, decoded or not, with keys
+        (reference key, channel A, channel B).
+
+    Note
+    ----
+    Only spectra and transfer functions are read. Time series and
+    coefficients are skipped.
+    """
+
+    def __init__(self, path, types=None, channels=None, references=None):
+        """Initiate StreamingDiaggui with a diaggui XML file.
+
+        Parameters
+        ----------
+        path: string
+            The path to the diaggui XML output file.
+        types: list of strings, optional
+            The type names of the results to be decoded.
+            If None, all types are decoded.
+            Defaults to None.
+        channels: list of strings, optional
+            The channels of the results and references to be decoded.
+            If None, all channels are decoded.
+            Defaults to None.
+        references: list of int, optional
+            The indices of the references to be decoded.
+            If None, the references are selected by channels.
+            Defaults to None.
+        """
+
+        self.types = None if types is None else set(types)
+        self.channels = None if channels is None else set(channels)
+        self.references = None if references is None else set(references)
+        super().__init__(path, cache=None)
+
+    def _read(self):
+        """Parse the file incrementally, decoding the selected nodes."""
+        results = {}
+        references = {}
+        self._reference_channels = {}
+        depth = 0
+        root = None
+        node = None
+        selected = False
+        for event, elem in xml.etree.ElementTree.iterparse(
+                self.path, events=('start', 'end')):
+            if event == 'start':
+                depth += 1
+                if depth == 1:
+                    root = elem
+                elif depth == 2:
+                    node = elem
+                continue
+            depth -= 1
+            if depth == 2 and elem.tag == 'Array' and node is not None:
+                # The parameters come before the data, so unselected data
+                # can be dropped before the next node is read.
+                selected = self._select(node)
+                if not selected:
+                    elem.clear()
+            elif depth == 1:
+                if selected:
+                    self._decode(node, results, references)
+                selected = False
+                node = None
+                # Drop the node, which the parser keeps in the root.
+                root.clear()
+        items = Bunch()
+        items.references = Bunch(references)
+        items.results = Bunch(results)
+        return(items)
+
+    def _node_info(self, node):
+        """Return the kind, index, keys and channels of a node, or None."""
+        match = node_name_pattern.match(node.get('Name', ''))
+        node_type = node.get('Type')
+        if match is None or node_type not in node_keys:
+            return(None)
+        subtype = None
+        channel_a = None
+        channel_bs = {}
+        for param in node.iterfind('Param'):
+            name = param.get('Name')
+            if name == 'Subtype':
+                subtype = int(param.text)
+            elif name == 'ChannelA':
+                channel_a = param.text
+            elif name.startswith('ChannelB['):
+                channel_bs[int(name[len('ChannelB['):-1])] = param.text
+        if subtype not in node_keys[node_type]:
+            return(None)
+        channel_bs = [channel_bs[i] for i in sorted(channel_bs)]
+        return(match.group(1), int(match.group(2)),
+            node_keys[node_type][subtype], channel_a, channel_bs)
+
+    def _select(self, node):
+        """Tell if a node is decoded and index it if it's a reference."""
+        info = self._node_info(node)
+        if info is None:
+            return(False)
+        kind, index, (type_name, key), channel_a, channel_bs = info
+        in_channels = (self.channels is None or channel_a in self.channels
+            or any(channel_b in self.channels for channel_b in channel_bs))
+        if kind == 'Reference':
+            self._reference_channels[index] = (key, channel_a, channel_bs)
+            if self.references is not None:
+                return(index in self.references)
+            return(in_channels)
+        return(in_channels
+            and (self.types is None or type_name in self.types))
+
+    def _decode(self, node, results, references):
+        """Decode a node as dtt2hdf.read_diaggui() does."""
+        kind, index = node_name_pattern.match(node.get('Name')).groups()
+        data = node_parsers[node.get('Type')](node)
+        if kind == 'Reference':
+            references[int(index)] = data
+        else:
+            results.setdefault(data.type_name, {})[data.channelA] = data
+
+    def _index_references(self):
+        """Index all references, including those not decoded."""
+        self.reference_index = {}
+        for index in sorted(self._reference_channels):
+            key, channel_a, channel_bs = self._reference_channels[index]
+            for channel_b in [None] + channel_bs:
+                self.reference_index.setdefault(
+                    (key, channel_a, channel_b), []).append(index)
+
+    def get_reference(self, index):
+        """Read a decoded reference plot from the diaggui XML file.
+
+        See :code:`Diaggui.get_reference()`.
+
+        Raises
+        ------
+        ValueError
+            If the reference is not decoded.
+        """
+
+        self._check_decoded(index)
+        return(super().get_reference(index))
+
+    def get_reference_data(self, index, reference_key):
+        """Read the data of a decoded reference plot without copying.
+
+        See :code:`Diaggui.get_reference_data()`.
+
+        Raises
+        ------
+        ValueError
+            If the reference is not decoded.
+        """
+
+        self._check_decoded(index)
+        return(super().get_reference_data(index, reference_key))
+
+    def _check_decoded(self, index):
+        if index not in self.items.references:
+            raise ValueError('Reference {} of {} is not decoded.'\
+                ''.format(index, self.path))
@@ -1,13 +1,21 @@
 """Easy channel access (EZCA) utilities."""
-import datetime
+import concurrent.futures
 import time
 
 import numpy as np
 
+from vishack.logger import logger
 
-def parallel_time_average(ezca, channels, duration=1., fs=None):
+default_max_workers = 16
+
+
+def parallel_time_average(ezca, channels, duration=1., fs=None,
+                          max_workers=default_max_workers):
     """Read process variables channels and returns a dict of time averages
-    
+
+    The averages are accumulated while reading, so the time series are not
+    stored.
+
     Parameters
     ----------
     ezca : ezca.ezca.Ezca
@@ -23,6 +31,9 @@ def parallel_time_average(ezca, channels, duration=1., fs=None):
         is maximum at 8 Hz.
         If None, will read as fast as it can.
         Defaults None.
+    max_workers : int, optional
+        The maximum number of channels read at the same time.
+        Defaults to 16.
 
     Returns
     -------
@@ -30,40 +41,390 @@ def parallel_time_average(ezca, channels, duration=1., fs=None):
         A dictionary with channel names as the keys and the time average as
         the value.
     """
-    d_time_series = parallel_time_series(
-        ezca=ezca, channels=channels, duration=duration, fs=fs)
+    statistics = parallel_time_statistics(
+        ezca=ezca, channels=channels, duration=duration, fs=fs,
+        max_workers=max_workers)
     d_time_average = {}
-    for key in d_time_series.keys():
-        if key == "t":
-            continue
-        d_time_average[key] = np.mean(d_time_series[key])
+    for channel, mean in zip(statistics.channels, statistics.mean):
+        d_time_average[channel] = mean
     return d_time_average
 
 
-def parallel_read(ezca, channels):
+def parallel_time_statistics(ezca, channels, duration=1., fs=None,
+                             max_workers=default_max_workers):
+    """Read channels and returns their running statistics.
+
+    Memory usage doesn't grow with the duration as only the running
+    statistics are kept.
+
+    Parameters
+    ----------
+    ezca : ezca.ezca.Ezca
+        Ezca instance.
+    channels : list of str
+        The channels to be read.
+    duration : float, optional
+        The duration (s).
+        Defaults to 1 second.
+    fs : float, optional
+        Sampling frequency (s).
+        If None, will read as fast as it can.
+        Defaults None.
+    max_workers : int, optional
+        The maximum number of channels read at the same time.
+        Defaults to 16.
+
+    Returns
+    -------
+    RunningStatistics
+        The mean, variance, minimum, maximum and number of samples of each
+        channel.
+    """
+    statistics = RunningStatistics(channels)
+    stats = {}
+    for _, values in iter_samples(
+            ezca=ezca, channels=channels, duration=duration, fs=fs,
+            max_workers=max_workers, stats=stats):
+        statistics.update(values)
+    _log_sampling_stats(stats)
+    return statistics
+
+
+class RunningStatistics:
+    """Running mean, variance, minimum and maximum of channels.
+
+    The mean and variance are updated with Welford's algorithm, which is
+    numerically stable, so the samples don't have to be stored.
+
+    Parameters
+    ----------
+    channels : list of str
+        The channels.
+
+    Attributes
+    ----------
+    channels : list of str
+        The channels.
+    count : int
+        The number of samples.
+    mean : array
+        The mean of each channel.
+    min : array
+        The minimum of each channel.
+    max : array
+        The maximum of each channel.
+    """
+    def __init__(self, channels):
+        self.channels = list(channels)
+        n_channels = len(self.channels)
+        self.count = 0
+        self.mean = np.zeros(n_channels)
+        self.min = np.full(n_channels, np.inf)
+        self.max = np.full(n_channels, -np.inf)
+        self._m2 = np.zeros(n_channels)
+
+    def update(self, values):
+        """Add a sample of all channels.
+
+        Parameters
+        ----------
+        values : array
+            The values of the channels, in the order of channels.
+        """
+        values = np.asarray(values, dtype=float)
+        self.count += 1
+        delta = values - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (values - self.mean)
+        np.minimum(self.min, values, out=self.min)
+        np.maximum(self.max, values, out=self.max)
+
+    def variance(self, ddof=0):
+        """The variance of each channel.
+
+        Parameters
+        ----------
+        ddof : int, optional
+            Delta degrees of freedom, as in numpy.var().
+            Defaults to 0.
+
+        Returns
+        -------
+        array
+            The variance. NaN if there are not more than ddof samples.
+        """
+        if self.count <= ddof:
+            return np.full(len(self.channels), np.nan)
+        return self._m2 / (self.count-ddof)
+
+    def std(self, ddof=0):
+        """The standard deviation of each channel.
+
+        Parameters
+        ----------
+        ddof : int, optional
+            Delta degrees of freedom, as in numpy.std().
+            Defaults to 0.
+
+        Returns
+        -------
+        array
+            The standard deviation.
+        """
+        return np.sqrt(self.variance(ddof=ddof))
+
+    def to_dict(self):
+        """Returns the statistics of each channel.
+
+        Returns
+        -------
+        dict
+            A dictionary with channel names as the keys and dictionaries
+            with keys "mean", "std", "min", "max" and "count" as the values.
+        """
+        d = {}
+        std = self.std()
+        for i, channel in enumerate(self.channels):
+            d[channel] = {
+                "mean": self.mean[i],
+                "std": std[i],
+                "min": self.min[i],
+                "max": self.max[i],
+                "count": self.count,
+            }
+        return d
+
+
+class SampleBuffer:
+    """Samples of channels in one preallocated 2-D array.
+
+    Sample i of all channels is row i of a (n_samples, n_channels) float
+    array, which is filled in place. If more samples are added than
+    allocated, the arrays are reallocated with double the size.
+
+    Parameters
+    ----------
+    channels : list of str
+        The channels.
+    size : int, optional
+        The number of samples allocated.
+        Defaults to 1024.
+
+    Attributes
+    ----------
+    channels : list of str
+        The channels.
+    index : dict
+        The column of each channel.
+    count : int
+        The number of samples.
+    """
+    def __init__(self, channels, size=1024):
+        self.channels = list(channels)
+        self.index = {channel: i for i, channel in enumerate(self.channels)}
+        self.count = 0
+        self._t = np.zeros(max(size, 1))
+        self._values = np.zeros((max(size, 1), len(self.channels)))
+
+    @property
+    def t(self):
+        """The times (s) of the samples, shape (count,)."""
+        return self._t[:self.count]
+
+    @property
+    def values(self):
+        """The samples, shape (count, n_channels), a view of the buffer."""
+        return self._values[:self.count]
+
+    def __getitem__(self, channel):
+        """The time series of a channel, a view of the buffer."""
+        return self._values[:self.count, self.index[channel]]
+
+    def next_row(self):
+        """Returns the row for the next sample, growing the buffer if full.
+
+        The row is counted as a sample only once :code:`commit()` is
+        called.
+
+        Returns
+        -------
+        array
+            The row, a view of the buffer.
+        """
+        if self.count == len(self._t):
+            size = 2*len(self._t)
+            self._t = np.resize(self._t, size)
+            values = np.zeros((size, len(self.channels)))
+            values[:self.count] = self._values[:self.count]
+            self._values = values
+        return self._values[self.count]
+
+    def commit(self, t):
+        """Count the row from :code:`next_row()` as a sample.
+
+        Parameters
+        ----------
+        t : float
+            The time of the sample (s).
+        """
+        self._t[self.count] = t
+        self.count += 1
+
+    def append(self, t, values):
+        """Add a sample.
+
+        Parameters
+        ----------
+        t : float
+            The time of the sample (s).
+        values : array
+            The values of the channels, in the order of channels.
+        """
+        self.next_row()[:] = values
+        self.commit(t)
+
+    def to_dict(self):
+        """Returns a dict of time-series, as :code:`parallel_time_series()`.
+
+        The arrays are views of the buffer.
+
+        Returns
+        -------
+        dict
+            A dictionary with channel names as the keys and time-series as
+            the values, and the times of the samples as "t".
+        """
+        d = {"t": self.t}
+        for channel in self.channels:
+            d[channel] = self[channel]
+        return d
+
+    def to_pandas(self):
+        """Returns a pandas DataFrame of the samples.
+
+        Returns
+        -------
+        pandas.DataFrame
+            The samples with the channels as the columns and the times as
+            the index.
+        """
+        import pandas
+
+        return pandas.DataFrame(
+            self.values, index=pandas.Index(self.t, name="t"),
+            columns=self.channels, copy=False)
+
+
+def parallel_read(ezca, channels, max_workers=default_max_workers,
+                  executor=None, out=None, bulk=False):
     """Read channels values and returns a dict of values in the EPICS record.
 
+    The channels are read concurrently by a pool of threads.
+
     Parameters
     ----------
     ezca : ezca.ezca.Ezca
         Ezca instance.
     channels : list of str
         The channels to the read
+    max_workers : int, optional
+        The maximum number of channels read at the same time.
+        If 1, the channels are read one by one.
+        Ignored if executor is given.
+        Defaults to 16.
+    executor : concurrent.futures.ThreadPoolExecutor, optional
+        The thread pool used to read the channels, e.g. from
+        :code:`read_executor()` to reuse the threads over many reads.
+        If None, a thread pool is created for this read.
+        Defaults to None.
+    out : array, optional
+        A float array with one element per channel. If given, the values
+        are written into it in the order of channels and it is returned
+        instead of a dict.
+        Defaults to None.
+    bulk : boolean, optional
+        If True and the Ezca instance has a :code:`read_many()` method,
+        e.g. :code:`vishack.fakeezca.Ezca`, all channels are read with it
+        at once instead of with the pool of threads.
+        Defaults to False.
 
     Returns
     -------
-    dict
+    dict or array
         A dictionary with channel names as the key and time-series as
-        the value.
+        the value, in the order of channels. Or out, if given.
+    """
+    if out is None:
+        values = [None] * len(channels)
+    else:
+        values = out
+
+    def read(i):
+        values[i] = ezca.read(channels[i])
+
+    indices = range(len(channels))
+    if bulk and hasattr(ezca, 'read_many'):
+        values[:] = ezca.read_many(channels)
+    elif executor is None:
+        if max_workers is not None and max_workers <= 1:
+            for i in indices:
+                read(i)
+        else:
+            with read_executor(max_workers, len(channels)) as executor:
+                list(executor.map(read, indices))
+    else:
+        list(executor.map(read, indices))
+    if out is not None:
+        return out
+    return dict(zip(channels, values))
+
+
+def read_executor(max_workers=default_max_workers, n_channels=None):
+    """Create a thread pool for reading channels.
+
+    Parameters
+    ----------
+    max_workers : int, optional
+        The maximum number of threads.
+        Defaults to 16.
+    n_channels : int, optional
+        The number of channels to be read. No more threads than channels
+        are created.
+        Defaults to None.
+
+    Returns
+    -------
+    concurrent.futures.ThreadPoolExecutor
+        The thread pool.
     """
-    d = {}
-    for channel in channels:
-        d[channel] = ezca.read(channel)
-    return d
+    if max_workers is None:
+        max_workers = default_max_workers
+    if n_channels is not None:
+        max_workers = max(1, min(max_workers, n_channels))
+    return concurrent.futures.ThreadPoolExecutor(
+        max_workers=max_workers, initializer=_use_initial_context)
 
-def parallel_time_series(ezca, channels, duration=1., fs=None):
+
+def _use_initial_context():
+    """Attach the reading thread to the channel access context of pyepics,
+    which ezca is built on.
+    """
+    try:
+        import epics.ca
+    except ImportError:
+        return
+    epics.ca.use_initial_context()
+
+def parallel_time_series(ezca, channels, duration=1., fs=None,
+                         max_workers=default_max_workers,
+                         return_stats=False, as_buffer=False):
     """Read channels time-series and returns of dict of time-series.
 
+    Samples are scheduled at absolute deadlines, every 1/fs seconds from
+    the start on a monotonic clock, so slow reads don't make the sampling
+    drift. A sample that can't be read before the deadline of the next one
+    is skipped.
+
     Parameters
     ----------
     ezca : ezca.ezca.Ezca
@@ -79,27 +440,152 @@ def parallel_time_series(ezca, channels, duration=1., fs=None):
         is maximum at 8 Hz.
         If None, will read as fast as it can.
         Defaults None.
+    max_workers : int, optional
+        The maximum number of channels read at the same time.
+        If 1, the channels are read one by one.
+        Defaults to 16.
+    return_stats : boolean, optional
+        Also return the sampling statistics.
+        Defaults to False.
+    as_buffer : boolean, optional
+        Return the SampleBuffer holding the samples instead of a dict.
+        Defaults to False.
 
     Returns
     -------
-    dict
+    dict or SampleBuffer
         A dictionary with channel names as the keys and time-series as the
-        values.
+        values. The key "t" has the times (s) since the start at which the
+        reads of the samples started. The time-series are views of one
+        (n_samples, n_channels) array.
+    dict, optional
+        The sampling statistics, if return_stats is True.
+        See :code:`iter_samples()`.
     """
+    stats = {}
     if fs is None:
-        fs = np.inf
-    d_values = {}
-    d_time_series = {}
-    t = np.arange(0, duration, 1/fs)
-    d_time_series["t"] = t
-    for i in range(len(t)):
-        d_values = parallel_read(ezca=ezca, channels=channels)
-        time_next = datetime.datetime.now()+ datetime.timedelta(seconds=1/fs)
-        for key in d_values.keys():
-            if key not in d_time_series.keys():
-                d_time_series[key] = np.zeros_like(t)
-            d_time_series[key][i] = d_values[key]
-        while datetime.datetime.now() < time_next:
-            time.sleep(1/fs/100)
+        buffer = SampleBuffer(channels)
+    else:
+        buffer = SampleBuffer(
+            channels, size=len(np.arange(0, duration, 1/fs)))
+    for _ in iter_samples(
+            ezca=ezca, channels=channels, duration=duration, fs=fs,
+            max_workers=max_workers, stats=stats, buffer=buffer):
+        pass
+    _log_sampling_stats(stats)
+    if as_buffer:
+        d_time_series = buffer
+    else:
+        d_time_series = buffer.to_dict()
+    if return_stats:
+        return d_time_series, stats
     return d_time_series
 
+
+def iter_samples(ezca, channels, duration=1., fs=None,
+                 max_workers=default_max_workers, stats=None, buffer=None):
+    """Read channels at a sampling frequency and yield the samples.
+
+    Samples are scheduled at absolute deadlines, every 1/fs seconds from
+    the start on a monotonic clock, so slow reads don't make the sampling
+    drift. A sample that can't be read before the deadline of the next one
+    is skipped.
+
+    Parameters
+    ----------
+    ezca : ezca.ezca.Ezca
+        Ezca instance.
+    channels : list of str
+        The channels to be read.
+    duration : float, optional
+        The duration (s).
+        If None, read until the generator is closed.
+        Defaults to 1 second.
+    fs : float, optional
+        Sampling frequency (s).
+        If None, will read as fast as it can.
+        Defaults None.
+    max_workers : int, optional
+        The maximum number of channels read at the same time.
+        If 1, the channels are read one by one.
+        Defaults to 16.
+    stats : dict, optional
+        If given, it is filled with the sampling statistics.
+        "samples" is the number of samples read, "missed" the number of
+        skipped samples, "overruns" the number of samples which took longer
+        than 1/fs to read and "max lag" the maximum delay (s) of a sample
+        from its deadline. Only "samples" is counted if fs is None.
+        Defaults to None.
+    buffer : SampleBuffer, optional
+        If given, the samples are read into the rows of the buffer.
+        Defaults to None.
+
+    Yields
+    ------
+    float
+        The time (s) since the start at which the read of the sample
+        started.
+    array
+        The values of the channels, in the order of channels. Without a
+        buffer, the same array is reused for every sample, so copy it to
+        keep it.
+    """
+    if duration is None:
+        duration = np.inf
+    if fs is None:
+        n_samples = None
+        period = 0.
+    elif np.isinf(duration):
+        n_samples = np.inf
+        period = 1/fs
+    else:
+        n_samples = len(np.arange(0, duration, 1/fs))
+        period = 1/fs
+    if stats is None:
+        stats = {}
+    stats.update({"samples": 0, "missed": 0, "overruns": 0, "max lag": 0.})
+    row = np.zeros(len(channels))
+    executor = None
+    if max_workers is None or max_workers > 1:
+        executor = read_executor(max_workers, len(channels))
+    try:
+        start = time.monotonic()
+        i = 0
+        while n_samples is None or i < n_samples:
+            deadline = start + i*period
+            now = time.monotonic()
+            if n_samples is None and now - start >= duration:
+                break
+            if now < deadline:
+                time.sleep(deadline-now)
+                now = time.monotonic()
+            if buffer is not None:
+                row = buffer.next_row()
+            parallel_read(
+                ezca=ezca, channels=channels, max_workers=max_workers,
+                executor=executor, out=row)
+            if buffer is not None:
+                buffer.commit(now-start)
+            stats["samples"] += 1
+            if n_samples is not None:
+                stats["max lag"] = max(stats["max lag"], now-deadline)
+                # Samples whose next deadline has passed are skipped.
+                end = time.monotonic()
+                if end > deadline+period:
+                    stats["overruns"] += 1
+                next_i = max(i+1, int((end-start)/period))
+                next_i = min(next_i, n_samples)
+                stats["missed"] += next_i - (i+1)
+                i = next_i
+            yield now-start, row
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+
+def _log_sampling_stats(stats):
+    """Warn about slow reads."""
+    if stats["overruns"] > 0 or stats["missed"] > 0:
+        logger.warning("{} reads took longer than the sampling period "
+                       "and {} samples were missed."
+                       "".format(stats["overruns"], stats["missed"]))
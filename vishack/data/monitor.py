@@ -0,0 +1,251 @@
+"""Continuous monitoring of EPICS channels with rolling averages."""
+import csv
+import os
+import threading
+import time
+
+import numpy as np
+
+import vishack.data.ezca
+
+default_buffer_size = 4096
+default_flush_interval = 10.
+
+
+class RingBuffer:
+    """Fixed-size buffer of the latest samples of channels.
+
+    The arrays are allocated once. New samples overwrite the oldest ones
+    when the buffer is full.
+
+    Parameters
+    ----------
+    size : int
+        The maximum number of samples kept.
+    n_channels : int
+        The number of channels.
+
+    Attributes
+    ----------
+    size : int
+        The maximum number of samples kept.
+    count : int
+        The number of samples in the buffer.
+    """
+    def __init__(self, size, n_channels):
+        if size < 1:
+            raise ValueError("The buffer size must be at least 1.")
+        self.size = size
+        self.count = 0
+        self._t = np.zeros(size)
+        self._values = np.zeros((size, n_channels))
+        self._next = 0
+
+    def append(self, t, values):
+        """Add a sample.
+
+        Parameters
+        ----------
+        t : float
+            The time of the sample (s).
+        values : array
+            The values of the channels.
+        """
+        self._t[self._next] = t
+        self._values[self._next] = values
+        self._next = (self._next+1) % self.size
+        self.count = min(self.count+1, self.size)
+
+    def data(self):
+        """Returns the samples in time order.
+
+        Returns
+        -------
+        array
+            The times of the samples, shape (count,).
+        array
+            The values of the samples, shape (count, n_channels).
+        """
+        if self.count < self.size:
+            return self._t[:self.count], self._values[:self.count]
+        order = np.roll(np.arange(self.size), -self._next)
+        return self._t[order], self._values[order]
+
+    def window(self, duration):
+        """Returns the samples within a duration from the latest one.
+
+        Parameters
+        ----------
+        duration : float
+            The duration of the window (s).
+
+        Returns
+        -------
+        array
+            The times of the samples in the window.
+        array
+            The values of the samples in the window.
+        """
+        t, values = self.data()
+        if len(t) == 0:
+            return t, values
+        start = np.searchsorted(t, t[-1]-duration, side="right")
+        return t[start:], values[start:]
+
+
+class Monitor:
+    """Sample channels continuously and flush rolling averages to a file.
+
+    The channels are read with :code:`vishack.data.ezca.iter_samples()`
+    into a RingBuffer, so the Ezca instance and the read threads are
+    created once for the whole monitoring.
+
+    Parameters
+    ----------
+    ezca : ezca.ezca.Ezca
+        Ezca instance.
+    channels : list of str
+        The channels to be read.
+    windows : list of float
+        The durations (s) of the rolling windows.
+    fs : float, optional
+        Sampling frequency (s).
+        If None, will read as fast as it can.
+        Defaults None.
+    output_path : str, optional
+        The path of the CSV file the snapshots are written to.
+        If None, snapshots are not written.
+        Defaults to None.
+    flush_interval : float, optional
+        The time (s) between snapshots.
+        Defaults to 10.
+    buffer_size : int, optional
+        The number of samples kept in the ring buffer. If None, it is the
+        number of samples in the longest window if fs is given, else 4096.
+        Defaults to None.
+    max_workers : int, optional
+        The maximum number of channels read at the same time.
+        Defaults to 16.
+
+    Attributes
+    ----------
+    buffer : RingBuffer
+        The latest samples.
+    channels : list of str
+        The channels.
+    stats : dict
+        The sampling statistics, see
+        :code:`vishack.data.ezca.iter_samples()`.
+    windows : list of float
+        The durations (s) of the rolling windows.
+    """
+    def __init__(self, ezca, channels, windows, fs=None, output_path=None,
+                 flush_interval=default_flush_interval, buffer_size=None,
+                 max_workers=vishack.data.ezca.default_max_workers):
+        self.ezca = ezca
+        self.channels = list(channels)
+        self.windows = list(windows)
+        self.fs = fs
+        self.output_path = output_path
+        self.flush_interval = flush_interval
+        self.max_workers = max_workers
+        if buffer_size is None:
+            if fs is None:
+                buffer_size = default_buffer_size
+            else:
+                buffer_size = int(np.ceil(max(self.windows)*fs)) + 1
+        self.buffer = RingBuffer(buffer_size, len(self.channels))
+        self.stats = {}
+        self._stop = threading.Event()
+
+    def run(self, duration=None):
+        """Monitor the channels until stopped.
+
+        A snapshot is flushed every flush interval and when monitoring ends.
+
+        Parameters
+        ----------
+        duration : float, optional
+            The duration (s) of the monitoring.
+            If None, monitor until :code:`stop()` is called.
+            Defaults to None.
+        """
+        self._stop.clear()
+        samples = vishack.data.ezca.iter_samples(
+            ezca=self.ezca, channels=self.channels, duration=duration,
+            fs=self.fs, max_workers=self.max_workers, stats=self.stats)
+        next_flush = time.monotonic() + self.flush_interval
+        try:
+            for t, values in samples:
+                self.buffer.append(t, values)
+                if self._stop.is_set():
+                    break
+                now = time.monotonic()
+                if now >= next_flush:
+                    self.flush()
+                    while next_flush <= now:
+                        next_flush += self.flush_interval
+        finally:
+            samples.close()
+            self.flush()
+
+    def stop(self):
+        """Stop monitoring after the current sample, e.g. from another
+        thread.
+        """
+        self._stop.set()
+
+    def snapshot(self):
+        """Returns the rolling statistics.
+
+        Returns
+        -------
+        dict
+            A dictionary with the window durations as the keys and
+            dictionaries with keys "mean", "std" and "count" as the values.
+            The means and standard deviations are arrays in the order of
+            channels.
+        """
+        d = {}
+        for window in self.windows:
+            _, values = self.buffer.window(window)
+            count = len(values)
+            if count > 0:
+                mean = values.mean(axis=0)
+                std = values.std(axis=0)
+            else:
+                mean = np.full(len(self.channels), np.nan)
+                std = np.full(len(self.channels), np.nan)
+            d[window] = {"mean": mean, "std": std, "count": count}
+        return d
+
+    def flush(self):
+        """Write a snapshot to the output file.
+
+        The file is replaced atomically so readers never see a partial
+        snapshot.
+        """
+        if self.output_path is None:
+            return
+        snapshot = self.snapshot()
+        header = ["channel"]
+        for window in self.windows:
+            header += [
+                "mean ({:g} s)".format(window),
+                "std ({:g} s)".format(window),
+                "count ({:g} s)".format(window),
+            ]
+        tmp_path = self.output_path + ".tmp"
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(header)
+            for i, channel in enumerate(self.channels):
+                row = [channel]
+                for window in self.windows:
+                    row += [
+                        repr(float(snapshot[window]["mean"][i])),
+                        repr(float(snapshot[window]["std"][i])),
+                        snapshot[window]["count"],
+                    ]
+                writer.writerow(row)
+        os.replace(tmp_path, self.output_path)
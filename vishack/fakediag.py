@@ -0,0 +1,68 @@
+""" Fake diag command for testing measurements on non-CDS machines
+
+Runs a diag script like :code:`diag -f script`, but instead of measuring it
+waits for a while and saves the restored diaggui XML file as it is.
+
+The behaviour can be changed with environment variables:
+
+* FAKEDIAG_DURATION: The duration of each measurement in seconds.
+  Defaults to 1.
+* FAKEDIAG_RETURNCODE: The return code of the command. Defaults to 0.
+"""
+import argparse
+import os
+import shutil
+import sys
+import time
+
+def parser():
+    parser = argparse.ArgumentParser(
+        description='Fake diag command for testing measurements')
+    parser.add_argument('-f', dest='script', type=str,
+        help='The diag script to run', required=True)
+    return parser
+
+def run_script(path, duration=1.):
+    """Run a diag script, saving the restored file instead of measuring.
+
+    Parameters
+    ----------
+    path: string
+        The path of the diag script.
+    duration: float, optional
+        The duration of each measurement in seconds.
+        Defaults to 1.
+    """
+
+    restored = None
+    with open(path, 'r') as f:
+        for line in f:
+            words = line.split()
+            if len(words) == 0:
+                continue
+            if words[0] == 'restore':
+                restored = words[1]
+                if not os.path.exists(restored):
+                    raise FileNotFoundError(
+                        '{} not exists'.format(restored))
+            elif words[0] == 'run':
+                time.sleep(duration)
+            elif words[0] == 'save':
+                saveas = words[1]
+                if os.path.abspath(saveas) != os.path.abspath(restored):
+                    shutil.copyfile(restored, saveas)
+                else:
+                    os.utime(saveas)
+            elif words[0] == 'quit':
+                break
+
+def main(args=None):
+    opts = parser().parse_args(args)
+    duration = float(os.environ.get('FAKEDIAG_DURATION', 1))
+    returncode = int(os.environ.get('FAKEDIAG_RETURNCODE', 0))
+    print('Running '+opts.script)
+    run_script(opts.script, duration=duration)
+    sys.exit(returncode)
+
+if __name__ == '__main__':
+    main()
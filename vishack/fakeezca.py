@@ -1,3 +1,6 @@
+# 2026/10/18 Turned into a simulator. Silent unless verbose, seeded NumPy
+    # generator, per-channel signal models, read latency and jitter, and
+    # read_many() for bulk reads.
 # 2020/06/14 Wasn't successful in simulated virtual systems. Using a dummy\
     # random while using read() instead.
 # 2020/06/13 Added fake_system compatibility for simulating virtual systems.
@@ -5,28 +8,197 @@
 # Fake guardian module with dummy Ezca class for debugging on non-CDS machines
 """ Fake guardian module with dummy Ezca class for debugging on non-CDS \
 machines
+
+Channels are simulated by signal models. Unless specified, channels read
+Gaussian noise around 3.1415926 with a standard deviation of 0.1.
+
+Example
+-------
+>>> import vishack.fakeezca
+>>> ezca = vishack.fakeezca.Ezca(
+...     'VIS-BS', seed=1, latency=0.01, jitter=0.005,
+...     models={'*_INMON': vishack.fakeezca.Sine(amplitude=1, frequency=0.1)})
+>>> ezca.read('IP_IDAMP_L_INMON')
 """
-from random import gauss
+import abc
+import fnmatch
+import threading
+import time
+
+import numpy as np
+
+
+class SignalModel(abc.ABC):
+    """Base class of the signal models of simulated channels."""
+    @abc.abstractmethod
+    def __call__(self, t, rng):
+        """Return the value of the channel.
+
+        Parameters
+        ----------
+        t : float
+            The time (s) since the Ezca instance was created.
+        rng : numpy.random.Generator
+            The random generator of the Ezca instance.
+        """
+
+
+class Constant(SignalModel):
+    """A constant value."""
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, t, rng):
+        return self.value
+
+
+class Gaussian(SignalModel):
+    """Gaussian noise around a mean."""
+    def __init__(self, mean=3.1415926, std=0.1):
+        self.mean = mean
+        self.std = std
+
+    def __call__(self, t, rng):
+        return self.mean + self.std*rng.standard_normal()
+
+
+class Sine(SignalModel):
+    """A sine wave with optional Gaussian noise."""
+    def __init__(self, amplitude=1., frequency=1., offset=0., phase=0.,
+                 noise=0.):
+        self.amplitude = amplitude
+        self.frequency = frequency
+        self.offset = offset
+        self.phase = phase
+        self.noise = noise
+
+    def __call__(self, t, rng):
+        value = self.offset + self.amplitude*np.sin(
+            2*np.pi*self.frequency*t + self.phase)
+        if self.noise > 0:
+            value += self.noise*rng.standard_normal()
+        return value
+
+
+class RandomWalk(SignalModel):
+    """A random walk with Gaussian steps at every read."""
+    def __init__(self, start=0., step=0.1):
+        self.value = start
+        self.step = step
+
+    def __call__(self, t, rng):
+        self.value += self.step*rng.standard_normal()
+        return self.value
+
 
 class Ezca():
     class Device():
         def __init__(self, prefix, delim=''):
             self._prefix=prefix
 
-    def __init__(self, prefix, logger=None):
+    def __init__(self, prefix, logger=None, latency=0., jitter=0.,
+                 seed=None, models=None, verbose=False):
+        """Fake Ezca.
+
+        Parameters
+        ----------
+        prefix : str
+            The channel prefix.
+        logger : optional
+            Ignored.
+        latency : float, optional
+            The time (s) each read takes, like a channel access round trip.
+            Defaults to 0.
+        jitter : float, optional
+            A random delay (s) up to this is added to each read.
+            Defaults to 0.
+        seed : int, optional
+            The seed of the random generator, for reproducible reads.
+            Defaults to None.
+        models : dict, optional
+            The SignalModel of the channels, with channel names or glob
+            patterns, e.g. '*_INMON', as the keys. The first matching
+            pattern is used. Other channels read Gaussian noise.
+            Defaults to None.
+        verbose : boolean, optional
+            Print the reads, writes and switches.
+            Defaults to False.
+        """
         self.dev = Ezca.Device(prefix, delim='')
         self.prefix = prefix
+        self.latency = latency
+        self.jitter = jitter
+        self.verbose = verbose
+        self.rng = np.random.default_rng(seed)
+        self.models = {}
+        if models is not None:
+            self.models.update(models)
+        self.default_model = Gaussian()
+        self._channel_models = {}
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+
+    def set_model(self, channel, model):
+        """Set the SignalModel of a channel or a glob pattern of channels."""
+        with self._lock:
+            self.models[channel] = model
+            self._channel_models = {}
 
     def read(self, channel, **kw):
         """Read channel value."""
-        print('Reading '+channel)
-        value = 3.1415926 + gauss(mu=0, sigma=0.1)# dummy for now
-        return value
+        if self.verbose:
+            print('Reading '+channel)
+        self._wait()
+        with self._lock:
+            return self._value(channel)
+
+    def read_many(self, channels, **kw):
+        """Read the values of channels in one round trip.
+
+        Returns
+        -------
+        array
+            The values, in the order of channels.
+        """
+        if self.verbose:
+            print('Reading '+', '.join(channels))
+        self._wait()
+        with self._lock:
+            return np.array([self._value(channel) for channel in channels],
+                            dtype=float)
 
     def write(self, channel, value):
         """Write value channel to channel."""
-        print('Writing '+str(value)+' to '+channel)
+        if self.verbose:
+            print('Writing '+str(value)+' to '+channel)
+        # Written values are read back.
+        self.set_model(channel, Constant(value))
 
     def switch(self, sfmname, *args):
         """Manipulate buttons in CDS Standard Filter Module (SFM)."""
-        print('Switching '+sfmname+' '+args[0]+' '+args[1])
+        if self.verbose:
+            print('Switching '+sfmname+' '+args[0]+' '+args[1])
+
+    def _wait(self):
+        """Sleep for the latency and jitter of a read."""
+        delay = self.latency
+        if self.jitter > 0:
+            with self._lock:
+                delay += self.jitter*self.rng.random()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _value(self, channel):
+        """Evaluate the model of a channel. Must hold the lock."""
+        model = self._channel_models.get(channel)
+        if model is None:
+            model = self.default_model
+            if channel in self.models:
+                model = self.models[channel]
+            else:
+                for pattern in self.models:
+                    if fnmatch.fnmatchcase(channel, pattern):
+                        model = self.models[pattern]
+                        break
+            self._channel_models[channel] = model
+        return model(time.monotonic()-self._start, self.rng)